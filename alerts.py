@@ -2,34 +2,82 @@
 alerts.py — Twilio WhatsApp + Voice Call integration for Aegis Surveillance.
 """
 
-import os
+import html
 import time
-from dotenv import load_dotenv
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from requests.adapters import HTTPAdapter
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+except ImportError:  # alerts are disabled without the Twilio SDK
+    Client = None
+
+from config import (
+    TWILIO_SID, TWILIO_TOKEN, TWILIO_FROM, ADMIN_TO,
+    TWILIO_PHONE_FROM, EMERGENCY_CALL_TO,
+)
+
+# Cooldown to avoid spamming calls — a caller claims the slot (under the lock)
+# before dialing, so concurrent HIGH alerts can't both place a call.
+_last_call_time = float("-inf")  # time.monotonic() of the last claimed call
+_call_lock = threading.Lock()
+CALL_COOLDOWN = 60  # Don't call more than once per 60 seconds
 
-load_dotenv(override=True)
+# Alerts are sent from a small worker pool so the detection loop never waits
+# on Twilio's HTTPS round-trips.
+ALERT_WORKERS = 4
+_alert_pool = ThreadPoolExecutor(max_workers=ALERT_WORKERS, thread_name_prefix="aegis-alert")
 
-TWILIO_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
-TWILIO_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
-TWILIO_FROM = os.getenv("TWILIO_WHATSAPP_FROM", "whatsapp:+14155238886")
-ADMIN_TO = os.getenv("ADMIN_WHATSAPP_TO", "")
+# Spoken message for emergency calls, built once; the description is
+# XML-escaped on substitution so it can't break out of the <Say> element.
+_TWIML = string.Template(
+    '<Response><Say voice="alice" language="en-IN">'
+    "Aegis Security Alert! High threat detected at your home. "
+    "$description "
+    "Please check your surveillance feed immediately. "
+    "Repeating: $description"
+    "</Say></Response>"
+)
 
-# Voice call settings
-TWILIO_PHONE_FROM = os.getenv("TWILIO_PHONE_FROM", "")  # Your Twilio phone number
-EMERGENCY_CALL_TO = os.getenv("EMERGENCY_CALL_TO", "")  # Phone to call on HIGH threat
+# Shared Twilio REST client — its pooled HTTP session keeps TLS connections
+# to api.twilio.com alive between alerts, with room for every alert worker.
+_client = None
+_client_lock = threading.Lock()
 
-# Cooldown to avoid spamming calls
-_last_call_time = 0.0
-CALL_COOLDOWN = 60  # Don't call more than once per 60 seconds
+
+# Settings are read once by config.py and never change, so both checks are
+# computed at import time.
+_CONFIGURED = bool(Client and TWILIO_SID and TWILIO_TOKEN and ADMIN_TO)
+_VOICE_CONFIGURED = bool(Client and TWILIO_SID and TWILIO_TOKEN and TWILIO_PHONE_FROM and EMERGENCY_CALL_TO)
 
 
 def is_configured() -> bool:
-    """Return True if Twilio credentials are set."""
-    return bool(TWILIO_SID and TWILIO_TOKEN and ADMIN_TO)
+    """Return True if the Twilio SDK is installed and credentials are set."""
+    return _CONFIGURED
 
 
 def is_voice_configured() -> bool:
     """Return True if voice call settings are configured."""
-    return bool(TWILIO_SID and TWILIO_TOKEN and TWILIO_PHONE_FROM and EMERGENCY_CALL_TO)
+    return _VOICE_CONFIGURED
+
+
+def _get_client():
+    """Return the shared Twilio client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = TwilioHttpClient()
+                http_client.session.mount("https://", HTTPAdapter(
+                    pool_connections=ALERT_WORKERS,
+                    pool_maxsize=ALERT_WORKERS * 2,
+                    max_retries=1,
+                ))
+                _client = Client(TWILIO_SID, TWILIO_TOKEN, http_client=http_client)
+    return _client
 
 
 def send_whatsapp_alert(message: str) -> bool:
@@ -42,8 +90,7 @@ def send_whatsapp_alert(message: str) -> bool:
         return False
 
     try:
-        from twilio.rest import Client
-        client = Client(TWILIO_SID, TWILIO_TOKEN)
+        client = _get_client()
 
         msg = client.messages.create(
             body=f"🚨 AEGIS ALERT 🚨\n\n{message}",
@@ -71,26 +118,18 @@ def make_emergency_voice_call(description: str) -> bool:
         print("[ALERTS] Voice call not configured — skipping. Set TWILIO_PHONE_FROM and EMERGENCY_CALL_TO in .env")
         return False
 
-    # Cooldown check
-    if (time.time() - _last_call_time) < CALL_COOLDOWN:
-        print(f"[ALERTS] Voice call cooldown active — skipping (wait {CALL_COOLDOWN}s between calls)")
-        return False
+    # Cooldown check — claim the slot before the (slow) Twilio request
+    with _call_lock:
+        now = time.monotonic()
+        if now - _last_call_time < CALL_COOLDOWN:
+            print(f"[ALERTS] Voice call cooldown active — skipping (wait {CALL_COOLDOWN}s between calls)")
+            return False
+        previous_call_time, _last_call_time = _last_call_time, now
 
     try:
-        from twilio.rest import Client
-        client = Client(TWILIO_SID, TWILIO_TOKEN)
-
-        # TwiML spoken message
-        twiml = f"""
-        <Response>
-            <Say voice="alice" language="en-IN">
-                Aegis Security Alert! High threat detected at your home.
-                {description}
-                Please check your surveillance feed immediately.
-                Repeating: {description}
-            </Say>
-        </Response>
-        """
+        client = _get_client()
+
+        twiml = _TWIML.substitute(description=html.escape(description))
 
         call = client.calls.create(
             twiml=twiml,
@@ -98,40 +137,42 @@ def make_emergency_voice_call(description: str) -> bool:
             to=EMERGENCY_CALL_TO,
         )
 
-        _last_call_time = time.time()
         print(f"[ALERTS] 📞 Emergency voice call placed — SID: {call.sid}")
         return True
 
     except Exception as e:
         print(f"[ALERTS] Failed to make voice call: {e}")
+        # Give the slot back so the next HIGH alert can retry
+        with _call_lock:
+            if _last_call_time == now:
+                _last_call_time = previous_call_time
         return False
 
 
+def _log_alert_failure(future):
+    """Done-callback: report exceptions that escaped an alert sender."""
+    exc = future.exception()
+    if exc is not None:
+        print(f"[ALERTS] Alert dispatch failed: {exc}")
+
+
 def send_high_threat_alert(description: str, description_telugu: str = "", action_needed: str = ""):
     """
     Send HIGH threat alerts via all channels:
     1. WhatsApp message
     2. Emergency voice call (if configured)
+    Non-blocking — both sends run on the alert worker pool.
     """
     # WhatsApp alert
-    lines = [
-        f"⚠️ HIGH THREAT DETECTED",
-        f"",
-        f"📍 {description}",
-    ]
-    if description_telugu:
-        lines.append(f"📍 {description_telugu}")
-    if action_needed:
-        lines.append(f"")
-        lines.append(f"⚡ Action: {action_needed}")
-
-    lines.extend([
-        f"",
-        f"🕐 Please check your surveillance feed immediately.",
-    ])
-
-    send_whatsapp_alert("\n".join(lines))
+    telugu_line = f"\n📍 {description_telugu}" if description_telugu else ""
+    action_line = f"\n\n⚡ Action: {action_needed}" if action_needed else ""
+    message = (
+        f"⚠️ HIGH THREAT DETECTED\n\n📍 {description}{telugu_line}{action_line}"
+        "\n\n🕐 Please check your surveillance feed immediately."
+    )
+
+    _alert_pool.submit(send_whatsapp_alert, message).add_done_callback(_log_alert_failure)
 
     # Voice call (with cooldown)
-    make_emergency_voice_call(description)
+    _alert_pool.submit(make_emergency_voice_call, description).add_done_callback(_log_alert_failure)
 
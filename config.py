@@ -0,0 +1,33 @@
+"""
+config.py — Environment settings for Aegis, read from .env once per process.
+
+Every other module imports its settings from here instead of calling
+load_dotenv() itself, so the .env file is parsed a single time (and not on
+every Streamlit rerun of main.py). It also picks the base64 module once:
+pybase64 when installed, else the stdlib one.
+"""
+
+import os
+from dotenv import load_dotenv
+try:
+    import pybase64 as base64  # SIMD-accelerated drop-in for the stdlib module
+except ImportError:
+    import base64
+
+load_dotenv(override=True)
+
+# Claude API
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
+
+# Twilio WhatsApp
+TWILIO_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
+TWILIO_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
+TWILIO_FROM = os.getenv("TWILIO_WHATSAPP_FROM", "whatsapp:+14155238886")
+ADMIN_TO = os.getenv("ADMIN_WHATSAPP_TO", "")
+
+# Twilio voice call
+TWILIO_PHONE_FROM = os.getenv("TWILIO_PHONE_FROM", "")  # Your Twilio phone number
+EMERGENCY_CALL_TO = os.getenv("EMERGENCY_CALL_TO", "")  # Phone to call on HIGH threat
+
+# PostgreSQL (empty → SQLite fallback)
+DATABASE_URL = os.getenv("DATABASE_URL", "")
@@ -3,13 +3,60 @@ database.py — PostgreSQL / SQLite event logging for Home Guard AI.
 """
 
 import os
+import time
+import uuid
+import atexit
 import sqlite3
-import datetime
-from dotenv import load_dotenv
+import threading
+import collections
+import urllib.parse
 
-load_dotenv(override=True)
+from config import DATABASE_URL, base64
 
-DATABASE_URL = os.getenv("DATABASE_URL", "")
+SQLITE_PATH = "security_events.db"
+EVENTS_DIR = "events"  # event snapshots are stored here as JPEG files
+MIGRATE_CHUNK_ROWS = 100  # legacy inline frames decoded per page at startup
+
+SQLITE_BUSY_TIMEOUT = 5.0  # seconds to wait out another connection's lock
+
+# Per-connection SQLite tuning, applied in a single executescript() call.
+# On the writer, WAL lets dashboard reads run alongside inserts (it is
+# persistent, so this is a no-op after the first connection) and NORMAL sync
+# drops the fsync per commit.
+_SQLITE_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA cache_size=-20000;"
+)
+_SQLITE_WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+)
+
+# Connections are opened lazily and reused. SQLite: one read-only connection
+# per thread for the dashboard queries plus a single shared writer guarded by
+# _writer_lock. Postgres: a shared connection pool.
+_conn_local = threading.local()
+_writer = None
+_writer_lock = threading.Lock()
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+PG_POOL_MAX = 8
+_pg_prepared = set()  # pooled Postgres connections that already ran _PG_PREPARE
+
+# log_event() only queues rows; a background flusher writes them in batches,
+# one transaction per batch, instead of one commit per event.
+FLUSH_BATCH_SIZE = 32
+FLUSH_INTERVAL = 0.25  # seconds
+_pending = collections.deque()
+_pending_lock = threading.Lock()
+_flush_wakeup = threading.Event()
+_flusher = None
+# Bumped after every committed flush; readers can key caches on it.
+_events_version = 0
+
+# The flusher also refreshes SQLite's planner statistics and truncates the
+# WAL this often, so a long-running dashboard keeps fast reads.
+MAINTENANCE_INTERVAL = 900  # seconds
 
 # ---------------------------------------------------------------------------
 # Connection helpers
@@ -20,24 +67,77 @@ def _use_postgres():
     return DATABASE_URL.startswith("postgresql")
 
 
+def _get_pg_pool():
+    """Return the process-wide psycopg2 connection pool, creating it on first use."""
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                _pg_pool = ThreadedConnectionPool(1, PG_POOL_MAX, DATABASE_URL)
+    return _pg_pool
+
+
 def _get_pg_connection():
-    """Return a psycopg2 connection."""
-    import psycopg2
-    return psycopg2.connect(DATABASE_URL)
+    """Borrow a psycopg2 connection from the pool, preparing statements on first use."""
+    conn = _get_pg_pool().getconn()
+    if conn not in _pg_prepared:
+        cur = conn.cursor()
+        for stmt in _PG_PREPARE:
+            cur.execute(stmt)
+        cur.close()
+        conn.commit()
+        _pg_prepared.add(conn)
+    return conn
 
 
-def _get_sqlite_connection():
-    """Return a sqlite3 connection (local fallback)."""
-    conn = sqlite3.connect("security_events.db")
+def _get_sqlite_connection(readonly: bool = False):
+    """
+    Return a sqlite3 connection (local fallback).
+    Opened in autocommit mode — writers issue an explicit BEGIN — and not
+    bound to the creating thread, so a connection can be handed to a worker.
+    """
+    if SQLITE_PATH == ":memory:":
+        conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False, isolation_level=None)
+    else:
+        mode = "ro" if readonly else "rwc"
+        uri = f"file:{urllib.parse.quote(SQLITE_PATH)}?mode={mode}"
+        conn = sqlite3.connect(
+            uri, uri=True, timeout=SQLITE_BUSY_TIMEOUT,
+            check_same_thread=False, isolation_level=None,
+        )
+        conn.executescript(_SQLITE_PRAGMAS if readonly else _SQLITE_WRITER_PRAGMAS + _SQLITE_PRAGMAS)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def get_connection():
-    """Return a database connection (Postgres or SQLite)."""
+def get_connection(readonly: bool = False):
+    """
+    Return a database connection (Postgres or SQLite).
+    Postgres connections are borrowed from the pool and must be handed back
+    with release_connection(). For SQLite, readonly callers get a cached
+    per-thread read-only connection; everyone else gets the shared writer
+    connection and must hold _writer_lock while using it.
+    """
+    global _writer
     if _use_postgres():
         return _get_pg_connection()
-    return _get_sqlite_connection()
+    if readonly and SQLITE_PATH != ":memory:":
+        conn = getattr(_conn_local, "reader", None)
+        if conn is None:
+            conn = _get_sqlite_connection(readonly=True)
+            _conn_local.reader = conn
+        return conn
+    if _writer is None:
+        _writer = _get_sqlite_connection()
+    return _writer
+
+
+def release_connection(conn):
+    """Return a connection obtained from get_connection() (no-op for SQLite)."""
+    if _use_postgres():
+        conn.rollback()  # end any open read transaction before pooling it
+        _get_pg_pool().putconn(conn)
 
 
 # ---------------------------------------------------------------------------
@@ -50,7 +150,7 @@ CREATE TABLE IF NOT EXISTS security_events (
     timestamp   TIMESTAMP DEFAULT NOW(),
     threat_level TEXT NOT NULL,
     event_description TEXT NOT NULL,
-    image_data  TEXT
+    image_path  TEXT
 );
 """
 
@@ -60,113 +160,370 @@ CREATE TABLE IF NOT EXISTS security_events (
     timestamp   TEXT DEFAULT (datetime('now', 'localtime')),
     threat_level TEXT NOT NULL,
     event_description TEXT NOT NULL,
-    image_data  TEXT
+    image_path  TEXT
 );
 """
 
+# Running per-level totals, bumped in the same transaction as each batch of
+# inserts so get_event_stats() never has to aggregate security_events.
+_CREATE_COUNTERS = """
+CREATE TABLE IF NOT EXISTS event_counters (
+    level       TEXT PRIMARY KEY,
+    cnt         INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Backfills the counters the first time they are created on a populated table.
+_SEED_COUNTERS = (
+    "INSERT INTO event_counters (level, cnt) "
+    "SELECT lower(threat_level), COUNT(*) FROM security_events GROUP BY lower(threat_level)"
+)
+
+# Serves ORDER BY timestamp DESC LIMIT n and the per-level counts.
+_CREATE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_events_ts ON security_events (timestamp DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_events_level ON security_events (threat_level)",
+)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
 
 def init_db():
-    """Create the security_events table if it doesn't exist."""
-    conn = get_connection()
-    cur = conn.cursor()
-    if _use_postgres():
-        cur.execute(_PG_CREATE_TABLE)
-    else:
-        cur.execute(_SQLITE_CREATE_TABLE)
-    conn.commit()
-    cur.close()
-    conn.close()
+    """
+    Create the security_events table if it doesn't exist.
+    Idempotent and cheap after the first call in a process — the CRUD helpers
+    call it themselves, so importing this module never touches the database.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with _writer_lock:
+            _create_schema()
+        _schema_ready = True
     print("[DB] security_events table ready.")
 
 
+def _create_schema():
+    """Run the CREATE TABLE / migration / index DDL for the active backend."""
+    # Postgres: borrow a raw connection — statements can't be PREPAREd
+    # against a table that doesn't exist yet.
+    conn = _get_pg_pool().getconn() if _use_postgres() else get_connection()
+    try:
+        cur = conn.cursor()
+        if _use_postgres():
+            cur.execute(_PG_CREATE_TABLE)
+            cur.execute("ALTER TABLE security_events ADD COLUMN IF NOT EXISTS image_path TEXT")
+            cur.execute(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_name = 'security_events' AND column_name = 'image_data'"
+            )
+            has_image_data = cur.fetchone() is not None
+        else:
+            cur.execute(_SQLITE_CREATE_TABLE)
+            columns = {row[1] for row in cur.execute("PRAGMA table_info(security_events)")}
+            if "image_path" not in columns:
+                cur.execute("ALTER TABLE security_events ADD COLUMN image_path TEXT")
+            has_image_data = "image_data" in columns
+        if has_image_data:
+            # Older databases kept base64 frames inline in image_data
+            _migrate_inline_images(cur)
+        for stmt in _CREATE_INDEXES:
+            cur.execute(stmt)
+        cur.execute(_CREATE_COUNTERS)
+        cur.execute("SELECT COUNT(*) FROM event_counters")
+        if cur.fetchone()[0] == 0:
+            cur.execute(_SEED_COUNTERS)
+        conn.commit()
+        cur.close()
+    finally:
+        release_connection(conn)
+
+
+def _migrate_inline_images(cur):
+    """
+    Move base64 frames from the legacy image_data column into EVENTS_DIR
+    files and point image_path at them. Migrated rows get image_data = NULL,
+    so later startups find nothing left to do. Rows are paged by id,
+    MIGRATE_CHUNK_ROWS at a time, so only one page of frames is in memory.
+    """
+    ph = "%s" if _use_postgres() else "?"
+    select = (
+        "SELECT id, image_data FROM security_events "
+        "WHERE image_data IS NOT NULL AND image_data <> '' AND image_path IS NULL "
+        f"AND id > {ph} ORDER BY id LIMIT {ph}"
+    )
+    update = f"UPDATE security_events SET image_path = {ph}, image_data = NULL WHERE id = {ph}"
+    last_id, total = 0, 0
+    while True:
+        cur.execute(select, (last_id, MIGRATE_CHUNK_ROWS))
+        page = cur.fetchall()
+        if not page:
+            break
+        last_id = page[-1][0]
+        moved = []
+        for event_id, image_data in page:
+            image_path = os.path.join(EVENTS_DIR, f"{uuid.uuid4().hex}.jpg")
+            try:
+                _save_snapshot(image_path, base64.b64decode(image_data))
+            except (ValueError, OSError) as e:
+                print(f"[DB] Could not migrate the snapshot of event {event_id}: {e}")
+                continue
+            moved.append((image_path, event_id))
+        if moved:
+            cur.executemany(update, moved)
+            total += len(moved)
+    if total:
+        print(f"[DB] Moved {total} inline snapshots to {EVENTS_DIR}/.")
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+# Kept as constants so SQLite's per-connection statement cache (keyed on the
+# SQL text) reuses the compiled statement; Postgres runs server-side PREPAREd
+# statements created once per pooled connection. Inserts are multi-row
+# statements with RETURNING id, so a whole batch is one round-trip that also
+# hands back the new event ids.
+
+INSERT_CHUNK_ROWS = 256  # rows per multi-row INSERT (stays under SQLite's variable limit)
+_SQL_INSERT_SQLITE = (
+    "INSERT INTO security_events (threat_level, event_description, image_path) "
+    "VALUES {values} RETURNING id"
+)
+_SQL_RECENT_SQLITE = (
+    "SELECT id, timestamp, threat_level, event_description, image_path "
+    "FROM security_events ORDER BY timestamp DESC LIMIT ?"
+)
+# Keyset pagination for the Security Log: walks back from a cursor id along
+# the primary key, so a page costs the same however deep it is.
+_SQL_BEFORE_SQLITE = (
+    "SELECT id, timestamp, threat_level, event_description, image_path "
+    "FROM security_events WHERE id < ? ORDER BY id DESC LIMIT ?"
+)
+_SQL_INSERT_PG = (
+    "INSERT INTO security_events (threat_level, event_description, image_path) "
+    "VALUES %s RETURNING id"
+)
+_SQL_RECENT_PG = "EXECUTE recent_events (%s)"
+_SQL_BEFORE_PG = "EXECUTE events_before (%s, %s)"
+_SQL_BUMP_COUNTER_SQLITE = (
+    "INSERT INTO event_counters (level, cnt) VALUES (?, ?) "
+    "ON CONFLICT (level) DO UPDATE SET cnt = event_counters.cnt + excluded.cnt"
+)
+_SQL_BUMP_COUNTER_PG = (
+    "INSERT INTO event_counters (level, cnt) VALUES (%s, %s) "
+    "ON CONFLICT (level) DO UPDATE SET cnt = event_counters.cnt + excluded.cnt"
+)
+_SQL_STATS = "SELECT level, cnt FROM event_counters"
+
+_PG_PREPARE = (
+    "PREPARE recent_events (int) AS "
+    "SELECT id, COALESCE(to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS'), ''), "
+    "threat_level, event_description, image_path "
+    "FROM security_events ORDER BY timestamp DESC LIMIT $1",
+    "PREPARE events_before (int, int) AS "
+    "SELECT id, COALESCE(to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS'), ''), "
+    "threat_level, event_description, image_path "
+    "FROM security_events WHERE id < $1 ORDER BY id DESC LIMIT $2",
+)
+
+
 # ---------------------------------------------------------------------------
 # CRUD helpers
 # ---------------------------------------------------------------------------
 
-def log_event(threat_level: str, description: str, image_base64: str = None):
-    """Insert a new security event into the database."""
-    conn = get_connection()
-    cur = conn.cursor()
-    if _use_postgres():
-        cur.execute(
-            "INSERT INTO security_events (threat_level, event_description, image_data) "
-            "VALUES (%s, %s, %s)",
-            (threat_level, description, image_base64),
-        )
-    else:
-        cur.execute(
-            "INSERT INTO security_events (threat_level, event_description, image_data) "
-            "VALUES (?, ?, ?)",
-            (threat_level, description, image_base64),
-        )
-    conn.commit()
-    cur.close()
-    conn.close()
+def log_event(threat_level: str, description: str, image_jpeg: bytes = None):
+    """
+    Queue a new security event for insertion. Non-blocking — rows are written
+    by the background flusher within FLUSH_INTERVAL, or sooner once
+    FLUSH_BATCH_SIZE events are pending. The snapshot is saved as a JPEG under
+    EVENTS_DIR and only its path is stored in the row.
+    """
+    image_path = os.path.join(EVENTS_DIR, f"{uuid.uuid4().hex}.jpg") if image_jpeg else None
+    with _pending_lock:
+        _pending.append((threat_level, description, image_path, image_jpeg))
+        pending = len(_pending)
+    _ensure_flusher()
+    if pending >= FLUSH_BATCH_SIZE:
+        _flush_wakeup.set()
+
+
+def flush():
+    """Write all queued events in a single transaction. Returns their new ids."""
+    global _events_version
+    with _pending_lock:
+        if not _pending:
+            return []
+        batch = list(_pending)
+        _pending.clear()
+
+    saved = []  # snapshot files written by this attempt
+    try:
+        init_db()
+        for _, _, image_path, image_jpeg in batch:
+            if image_path:
+                _save_snapshot(image_path, image_jpeg)
+                saved.append(image_path)
+        rows = [(level, desc, image_path) for level, desc, image_path, _ in batch]
+        counts = collections.Counter(level.lower() for level, _, _, _ in batch)
+
+        with _writer_lock:
+            conn = get_connection()
+            try:
+                cur = conn.cursor()
+                if _use_postgres():
+                    from psycopg2.extras import execute_values
+                    ids = [r[0] for r in execute_values(
+                        cur, _SQL_INSERT_PG, rows, page_size=INSERT_CHUNK_ROWS, fetch=True,
+                    )]
+                    cur.executemany(_SQL_BUMP_COUNTER_PG, counts.items())
+                else:
+                    cur.execute("BEGIN")
+                    ids = []
+                    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+                        chunk = rows[start:start + INSERT_CHUNK_ROWS]
+                        sql = _SQL_INSERT_SQLITE.format(values=", ".join(["(?, ?, ?)"] * len(chunk)))
+                        cur.execute(sql, [value for row in chunk for value in row])
+                        ids.extend(r[0] for r in cur.fetchall())
+                    cur.executemany(_SQL_BUMP_COUNTER_SQLITE, counts.items())
+                conn.commit()
+                cur.close()
+                _events_version += 1
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                release_connection(conn)
+    except Exception:
+        # Nothing was stored: drop this attempt's snapshots and put the batch
+        # back ahead of newer events, so the next flush retries it.
+        for image_path in saved:
+            try:
+                os.remove(image_path)
+            except OSError:
+                pass
+        with _pending_lock:
+            _pending.extendleft(reversed(batch))
+        raise
+    return sorted(ids)
+
+
+def events_version() -> int:
+    """Number of flushes committed by this process — changes whenever new events are stored."""
+    return _events_version
+
+
+def _save_snapshot(image_path: str, image_jpeg: bytes):
+    """Write JPEG bytes to image_path."""
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    with open(image_path, "wb") as f:
+        f.write(image_jpeg)
+
+
+def optimize():
+    """Run PRAGMA optimize and checkpoint/truncate the WAL (SQLite only)."""
+    if _use_postgres() or not _schema_ready:
+        return
+    with _writer_lock:
+        conn = get_connection()
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _flush_loop():
+    """
+    Background flusher: drain the pending queue every FLUSH_INTERVAL and run
+    optimize() every MAINTENANCE_INTERVAL.
+    """
+    last_maintenance = time.monotonic()
+    while True:
+        _flush_wakeup.wait(FLUSH_INTERVAL)
+        _flush_wakeup.clear()
+        try:
+            flush()
+            if time.monotonic() - last_maintenance >= MAINTENANCE_INTERVAL:
+                last_maintenance = time.monotonic()
+                optimize()
+        except Exception as e:
+            print(f"[DB] Failed to write queued events, will retry: {e}")
+
+
+def _ensure_flusher():
+    """Start the background flusher thread on first use."""
+    global _flusher
+    if _flusher is None:
+        with _pending_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="aegis-db-flush", daemon=True)
+                _flusher.start()
+
+
+def _shutdown():
+    """Flush queued events and leave the database optimized on exit."""
+    flush()
+    optimize()
+
+
+atexit.register(_shutdown)
+
+
+def _fetch_events(sql_pg: str, sql_sqlite: str, params: tuple):
+    """Run an event SELECT on the active backend and return the rows as dicts."""
+    init_db()
+    conn = get_connection(readonly=True)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql_pg if _use_postgres() else sql_sqlite, params)
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        release_connection(conn)
+
+    # Both backends return the timestamp as text (Postgres formats it in SQL),
+    # so every row maps the same way by position.
+    events = [
+        {"id": r[0], "timestamp": r[1], "threat_level": r[2], "description": r[3], "image_path": r[4]}
+        for r in rows
+    ]
+    return events
 
 
 def get_recent_events(limit: int = 20):
     """Return the most recent events as a list of dicts."""
-    conn = get_connection()
-    cur = conn.cursor()
-    if _use_postgres():
-        cur.execute(
-            "SELECT id, timestamp, threat_level, event_description, image_data "
-            "FROM security_events ORDER BY timestamp DESC LIMIT %s",
-            (limit,),
-        )
-    else:
-        cur.execute(
-            "SELECT id, timestamp, threat_level, event_description, image_data "
-            "FROM security_events ORDER BY timestamp DESC LIMIT ?",
-            (limit,),
-        )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    return _fetch_events(_SQL_RECENT_PG, _SQL_RECENT_SQLITE, (limit,))
 
-    events = []
-    for row in rows:
-        if _use_postgres():
-            events.append({
-                "id": row[0],
-                "timestamp": row[1].strftime("%Y-%m-%d %H:%M:%S") if row[1] else "",
-                "threat_level": row[2],
-                "description": row[3],
-                "image_data": row[4],
-            })
-        else:
-            events.append({
-                "id": row[0] if isinstance(row, tuple) else row["id"],
-                "timestamp": row[1] if isinstance(row, tuple) else row["timestamp"],
-                "threat_level": row[2] if isinstance(row, tuple) else row["threat_level"],
-                "description": row[3] if isinstance(row, tuple) else row["event_description"],
-                "image_data": row[4] if isinstance(row, tuple) else row["image_data"],
-            })
-    return events
+
+def get_events_before(cursor_id: int = None, limit: int = 50):
+    """
+    Return up to `limit` events with id < cursor_id, newest first (the newest
+    events when cursor_id is None). Pass the last id of one page as the cursor
+    for the next.
+    """
+    if cursor_id is None:
+        cursor_id = 2 ** 31 - 1  # above any id either backend hands out
+    return _fetch_events(_SQL_BEFORE_PG, _SQL_BEFORE_SQLITE, (cursor_id, limit))
 
 
 def get_event_stats():
-    """Return event counts grouped by threat_level."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT threat_level, COUNT(*) as cnt "
-        "FROM security_events GROUP BY threat_level"
-    )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    """Return event counts per threat level, read from the event_counters table."""
+    init_db()
+    conn = get_connection(readonly=True)
+    try:
+        cur = conn.cursor()
+        cur.execute(_SQL_STATS)
+        rows = cur.fetchall()
+        cur.close()
+    finally:
+        release_connection(conn)
 
     stats = {"low": 0, "medium": 0, "high": 0, "total": 0}
-    for row in rows:
-        level = row[0] if isinstance(row, tuple) else row["threat_level"]
-        count = row[1] if isinstance(row, tuple) else row["cnt"]
-        level_lower = level.lower()
-        if level_lower in stats:
-            stats[level_lower] = count
+    for level, count in rows:
+        if level in stats:
+            stats[level] = count
         stats["total"] += count
     return stats
 
-
-# Auto-init on import
-init_db()
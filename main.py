@@ -5,24 +5,23 @@ Premium Streamlit UI with local/browser camera support and real-time monitoring.
 
 import os
 import time
-import base64
+import shutil
 import tempfile
 import threading
 import streamlit as st
 import cv2
 import numpy as np
-from PIL import Image
-from io import BytesIO
-from dotenv import load_dotenv
 
-load_dotenv(override=True)
-
-from database import init_db, log_event, get_recent_events, get_event_stats
+from config import TWILIO_SID, TWILIO_TOKEN
+from database import (
+    init_db, log_event, flush as flush_events, events_version, get_recent_events,
+    get_events_before, get_event_stats,
+)
 from vision_engine import (
-    preprocess_frame, frame_to_base64, detect_motion, get_motion_score,
-    draw_status_overlay, draw_motion_border, draw_bounding_boxes,
+    TARGET_WIDTH, TARGET_HEIGHT, frame_to_base64, to_gray,
+    draw_hud,
     analyze_frame, analyze_frame_mock, is_claude_configured,
-    can_analyze, should_call_claude, BackgroundAnalyzer,
+    can_analyze, should_call_claude, BackgroundAnalyzer, CaptureThread,
 )
 from alerts import send_high_threat_alert, is_configured as is_twilio_configured, is_voice_configured
 
@@ -75,19 +74,45 @@ if not st.session_state.get("_welcome_shown", False):
     _show_welcome()
 
 
+# ---------------------------------------------------------------------------
+# Frame status (shared by all three frame paths)
+# ---------------------------------------------------------------------------
+# state -> (overlay text, overlay BGR colour, status-bar label); "{}" takes the
+# gating reason.
+STATUS_TABLE = {
+    "analyzing": ("ANALYZING...", (248, 189, 56), "🟠 Analyzing"),
+    "detected": ("DETECTED: {}", (68, 68, 239), "🔴 Sending"),
+    "motion": ("MOTION ({})", (11, 158, 245), "🟡 Motion"),
+    "stable": ("MONITORING", (16, 185, 129), "🟢 Stable"),
+}
+
+
+def frame_status(is_analyzing: bool, should_analyze: bool, motion: bool, filter_reason: str) -> tuple:
+    """Return (status_text, status_color, label) for the current frame."""
+    state = "analyzing" if is_analyzing else "detected" if should_analyze else "motion" if motion else "stable"
+    text, color, label = STATUS_TABLE[state]
+    return text.format(filter_reason), color, label
+
+
 # ---------------------------------------------------------------------------
 # WebRTC helpers (only used in Browser Camera mode)
 # ---------------------------------------------------------------------------
+@st.cache_resource(ttl=3300, show_spinner=False)
+def twilio_ice_servers():
+    """
+    Twilio TURN/STUN servers from a Network Traversal token. Cached for 55
+    minutes, well within the token's lifetime, so reruns don't each make an
+    HTTPS round-trip; failures raise and are therefore not cached.
+    """
+    from twilio.rest import Client
+    return Client(TWILIO_SID, TWILIO_TOKEN).tokens.create().ice_servers
+
+
 def get_rtc_config():
     """Get ICE config with Twilio TURN servers if available."""
     try:
-        sid = os.getenv("TWILIO_ACCOUNT_SID")
-        token = os.getenv("TWILIO_AUTH_TOKEN")
-        if sid and token:
-            from twilio.rest import Client
-            client = Client(sid, token)
-            t = client.tokens.create()
-            return RTCConfiguration({"iceServers": t.ice_servers})
+        if TWILIO_SID and TWILIO_TOKEN:
+            return RTCConfiguration({"iceServers": twilio_ice_servers()})
     except Exception:
         pass
     return RTCConfiguration({"iceServers": [
@@ -96,39 +121,65 @@ def get_rtc_config():
 
 
 class SharedState:
-    """Thread-safe shared state between WebRTC processor and Streamlit UI."""
+    """
+    Shared state between WebRTC processor and Streamlit UI.
+    "Latest value wins" fields are immutable tuples replaced with a single
+    attribute store (atomic in CPython), so the per-frame setters and the UI's
+    getters take no lock; only claim_alert() locks.
+    """
+    MOTION_HISTORY = 300
+    ALERT_DEBOUNCE = 60  # seconds between alerts with the same description
+
     def __init__(self):
         self._lock = threading.Lock()
-        self._last_result = None
-        self._last_b64 = None
-        self._status = "MONITORING"
-        self._motion_score = 0.0
-        self._filter_reason = "Waiting..."
+        self._last = (None, None)  # (result, jpeg)
+        self._status = ("MONITORING", 0.0, "Waiting...")  # (status, motion_score, filter_reason)
+        # Motion score history as a fixed float32 ring (MOTION_HISTORY samples),
+        # written only by the processor thread
+        self._motion_ring = np.zeros(self.MOTION_HISTORY, dtype=np.float32)
+        self._ring_idx = 0
         self._analyzer = BackgroundAnalyzer()
+        self._alert_dedup = {}  # hash(description) -> time.monotonic() of last alert
 
     def update_status(self, status, motion_score, filter_reason):
-        with self._lock:
-            self._status = status
-            self._motion_score = motion_score
-            self._filter_reason = filter_reason
+        self._status = (status, motion_score, filter_reason)
+        self._motion_ring[self._ring_idx % self.MOTION_HISTORY] = motion_score
+        self._ring_idx += 1  # published after the sample is written
 
     def get_status(self):
-        with self._lock:
-            return self._status, self._motion_score, self._filter_reason
+        return self._status
 
-    def set_result(self, result, b64):
-        with self._lock:
-            self._last_result = result
-            self._last_b64 = b64
+    def motion_history(self):
+        """Recent motion scores, oldest first, as a float32 array."""
+        idx = self._ring_idx
+        if idx <= self.MOTION_HISTORY:
+            return self._motion_ring[:idx].copy()
+        return np.roll(self._motion_ring, -(idx % self.MOTION_HISTORY))
+
+    def set_result(self, result, jpeg):
+        self._last = (result, jpeg)
 
     def get_result(self):
-        with self._lock:
-            return self._last_result, self._last_b64
+        return self._last
 
     @property
     def analyzer(self):
         return self._analyzer
 
+    def claim_alert(self, description: str) -> bool:
+        """
+        Debounce HIGH alerts: True if no alert with this description was sent
+        in the last ALERT_DEBOUNCE seconds (and record this one).
+        """
+        key = hash(description)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._alert_dedup.get(key, float("-inf")) < self.ALERT_DEBOUNCE:
+                return False
+            self._alert_dedup = {k: t for k, t in self._alert_dedup.items() if now - t < self.ALERT_DEBOUNCE}
+            self._alert_dedup[key] = now
+            return True
+
 
 if "shared_state" not in st.session_state:
     st.session_state.shared_state = SharedState()
@@ -136,146 +187,102 @@ shared = st.session_state.shared_state
 
 
 class AegisProcessor(VideoProcessorBase):
-    """WebRTC video processor for browser camera mode."""
+    """
+    WebRTC video processor for browser camera mode.
+    Drops to the latest frame: while a frame is still being processed, or if
+    one was processed less than 1/TARGET_FPS ago, incoming frames are answered
+    with the last rendered image instead of queueing up behind it.
+    """
+    TARGET_FPS = 15
+
     def __init__(self):
-        self.prev_frame = None
+        self.prev_gray = None
         self.use_mock = not is_claude_configured()
         self._shared = None
+        self._recv_lock = threading.Lock()
+        self._last_ts = 0.0
+        self._last_display = None
+        # Preallocated grayscale buffer that ping-pongs with prev_gray
+        self._gray_buf = None
 
     def set_shared(self, s):
         self._shared = s
 
     def recv(self, frame):
-        img = frame.to_ndarray(format="bgr24")
-        processed = preprocess_frame(img)
-        motion = detect_motion(self.prev_frame, processed)
-        motion_score = get_motion_score(self.prev_frame, processed)
-        should_analyze_flag, filter_reason, bboxes = should_call_claude(self.prev_frame, processed)
+        now = time.monotonic()
+        if self._last_display is not None:
+            if now - self._last_ts < 1.0 / self.TARGET_FPS or not self._recv_lock.acquire(blocking=False):
+                return self._to_video_frame(self._last_display, frame)
+        else:
+            self._recv_lock.acquire()
+        try:
+            self._last_ts = now
+            self._last_display = self._process(frame)
+            return self._to_video_frame(self._last_display, frame)
+        finally:
+            self._recv_lock.release()
+
+    @staticmethod
+    def _to_video_frame(display_frame, src):
+        out = av.VideoFrame.from_ndarray(display_frame, format="bgr24")
+        out.pts, out.time_base = src.pts, src.time_base
+        return out
+
+    def _process(self, frame):
+        """Run motion gating, analysis hand-off and overlays; return the BGR display frame."""
+        # libav scales in the source pixel format (usually YUV) and converts the
+        # 640x480 result to BGR in the same pass; no full-size BGR frame is made.
+        processed = frame.to_ndarray(width=TARGET_WIDTH, height=TARGET_HEIGHT, format="bgr24")
+        gray = to_gray(processed, out=self._gray_buf)
+        should_analyze_flag, filter_reason, bboxes, motion, motion_score = should_call_claude(self.prev_gray, gray)
 
         if self._shared:
             analyzer = self._shared.analyzer
-            bg_result, bg_b64 = analyzer.get_result()
+            bg_result, bg_jpeg = analyzer.get_result()
             if bg_result and "error" not in bg_result:
-                self._shared.set_result(bg_result, bg_b64)
-                try:
-                    log_event(bg_result.get("threat_level", "low"), bg_result.get("description", ""), bg_b64 or "")
-                except Exception: pass
-                if bg_result.get("threat_level", "").lower() == "high":
-                    try:
-                        send_high_threat_alert(bg_result.get("description", ""), bg_result.get("description_telugu", ""), bg_result.get("action_needed", ""))
-                    except Exception: pass
-
-        display_frame = processed.copy()
-        is_analyzing = self._shared.analyzer.is_busy if self._shared else False
+                self._shared.set_result(bg_result, bg_jpeg)
+                # Both return at once: log_event() only queues the row for the database
+                # flusher, and alerts are sent from the alert worker pool.
+                log_event(bg_result.get("threat_level", "low"), bg_result.get("description", ""), bg_jpeg)
+                if bg_result.get("threat_level", "").lower() == "high" and self._shared.claim_alert(bg_result.get("description", "")):
+                    send_high_threat_alert(bg_result.get("description", ""), bg_result.get("description_telugu", ""), bg_result.get("action_needed", ""))
 
-        if is_analyzing:
-            status_text, status_color, lbl = "ANALYZING...", (248, 189, 56), "🟠 Analyzing"
-        elif should_analyze_flag:
-            status_text, status_color, lbl = f"DETECTED: {filter_reason}", (68, 68, 239), "🔴 Sending"
-        elif motion:
-            status_text, status_color, lbl = f"MOTION ({filter_reason})", (11, 158, 245), "🟡 Motion"
-        else:
-            status_text, status_color, lbl = "MONITORING", (16, 185, 129), "🟢 Stable"
+        is_analyzing = self._shared.analyzer.is_busy if self._shared else False
 
-        display_frame = draw_status_overlay(display_frame, status_text, status_color)
-        display_frame = draw_motion_border(display_frame, motion)
-        if bboxes:
-            display_frame = draw_bounding_boxes(display_frame, bboxes)
+        status_text, status_color, lbl = frame_status(is_analyzing, should_analyze_flag, motion, filter_reason)
 
         if self._shared:
             self._shared.update_status(lbl, motion_score, filter_reason)
-            if should_analyze_flag and not self._shared.analyzer.is_busy:
+            # The analyzer keeps its own copy, so the clean frame is handed over
+            # first and the overlays are then drawn straight into it. While a
+            # batch is collecting, further candidates join it; submit() ignores
+            # frames once the analysis is running.
+            if should_analyze_flag:
                 self._shared.analyzer.submit(processed, use_mock=self.use_mock)
 
-        self.prev_frame = processed.copy()
-        return av.VideoFrame.from_ndarray(display_frame, format="bgr24")
+        # `processed` is a fresh array from to_ndarray() each frame, so it can
+        # be the display frame without a copy (recv may still be returning the
+        # previous one).
+        draw_hud(processed, status_text, status_color, motion, bboxes)
+
+        # gray becomes the new prev_gray; the old one is reused next frame
+        self.prev_gray, self._gray_buf = gray, self.prev_gray
+        return processed
 
 
 # ---------------------------------------------------------------------------
 # CSS
 # ---------------------------------------------------------------------------
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800;900&display=swap');
-    @import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;500&display=swap');
-
-    :root {
-        --bg-primary: #030712;
-        --bg-glass: rgba(15, 23, 42, 0.4);
-        --border: rgba(56, 189, 248, 0.08);
-        --border-hover: rgba(56, 189, 248, 0.2);
-        --accent: #38bdf8; --accent2: #818cf8;
-        --danger: #ef4444; --warning: #f59e0b; --success: #10b981;
-        --text-primary: #f1f5f9; --text-secondary: #94a3b8; --text-muted: #475569;
-    }
-    * { font-family: 'Inter', sans-serif; }
-    .stApp { background: var(--bg-primary); }
-
-    @keyframes pulse-glow { 0%,100%{box-shadow:0 0 15px rgba(56,189,248,0.1)} 50%{box-shadow:0 0 30px rgba(56,189,248,0.2)} }
-    @keyframes live-dot { 0%,100%{opacity:1} 50%{opacity:0.3} }
-    @keyframes slide-up { from{opacity:0;transform:translateY(10px)} to{opacity:1;transform:translateY(0)} }
-    @keyframes border-pulse { 0%,100%{border-color:rgba(239,68,68,0.3)} 50%{border-color:rgba(239,68,68,0.6)} }
-
-    .aegis-header {
-        background: var(--bg-glass); backdrop-filter: blur(20px);
-        padding: 1rem 1.5rem; border-radius: 16px; margin-bottom: 1rem;
-        border: 1px solid var(--border); display: flex; align-items: center;
-        justify-content: space-between; animation: pulse-glow 4s ease-in-out infinite;
-    }
-    .aegis-header .logo-group { display: flex; align-items: center; gap: 0.6rem; }
-    .aegis-header .shield { font-size: 2rem; filter: drop-shadow(0 0 8px rgba(56,189,248,0.4)); }
-    .aegis-header h1 {
-        background: linear-gradient(135deg, var(--accent), var(--accent2));
-        -webkit-background-clip: text; -webkit-text-fill-color: transparent;
-        font-size: 1.6rem; margin: 0; font-weight: 800; letter-spacing: 2px;
-    }
-    .aegis-header .tagline { color: var(--text-muted); margin: 0; font-size: 0.65rem; letter-spacing: 3px; text-transform: uppercase; }
-
-    .live-badge { display:flex; align-items:center; gap:0.4rem; padding:0.25rem 0.7rem; border-radius:20px; font-size:0.7rem; font-weight:600; letter-spacing:1px; }
-    .live-badge.active { background:rgba(16,185,129,0.1); color:var(--success); border:1px solid rgba(16,185,129,0.25); }
-    .live-badge.active .dot { width:6px; height:6px; background:var(--success); border-radius:50%; animation:live-dot 1.5s ease-in-out infinite; }
-    .live-badge.paused { background:rgba(245,158,11,0.1); color:var(--warning); border:1px solid rgba(245,158,11,0.25); }
+@st.cache_resource
+def load_css() -> str:
+    """Read styles.css once per process and wrap it in a single-line <style> block."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles.css"), encoding="utf-8") as f:
+        return "<style>" + " ".join(f.read().split()) + "</style>"
 
-    .stats-row { display:grid; grid-template-columns:repeat(4,1fr); gap:0.6rem; margin-bottom:0.8rem; }
-    .stat-card { background:var(--bg-glass); backdrop-filter:blur(12px); border:1px solid var(--border); border-radius:12px; padding:0.8rem 0.6rem; text-align:center; transition:all 0.3s ease; }
-    .stat-card:hover { border-color:var(--border-hover); transform:translateY(-2px); }
-    .stat-card .val { font-size:1.6rem; font-weight:800; margin:0; font-family:'JetBrains Mono',monospace; }
-    .stat-card .lbl { color:var(--text-muted); font-size:0.6rem; text-transform:uppercase; letter-spacing:1.5px; margin:0.15rem 0 0 0; }
-    .c-cyan{color:var(--accent)} .c-red{color:var(--danger)} .c-yellow{color:var(--warning)} .c-green{color:var(--success)}
 
-    .event-card { background:var(--bg-glass); backdrop-filter:blur(12px); border:1px solid var(--border); border-radius:10px; padding:0.7rem 0.9rem; margin-bottom:0.5rem; transition:all 0.25s ease; animation:slide-up 0.3s ease; }
-    .event-card:hover { border-color:var(--border-hover); background:rgba(15,23,42,0.7); }
-    .event-card.high-event { border-color:rgba(239,68,68,0.25); animation:border-pulse 2s ease-in-out infinite; }
-
-    .badge { display:inline-block; padding:0.15rem 0.55rem; border-radius:6px; font-size:0.6rem; font-weight:700; text-transform:uppercase; letter-spacing:0.8px; font-family:'JetBrains Mono',monospace; }
-    .badge-high { background:rgba(239,68,68,0.12); color:var(--danger); border:1px solid rgba(239,68,68,0.25); box-shadow:0 0 8px rgba(239,68,68,0.15); }
-    .badge-medium { background:rgba(245,158,11,0.12); color:var(--warning); border:1px solid rgba(245,158,11,0.25); }
-    .badge-low { background:rgba(16,185,129,0.12); color:var(--success); border:1px solid rgba(16,185,129,0.25); }
-
-    .analysis-card { background:var(--bg-glass); backdrop-filter:blur(16px); border:1px solid var(--border); border-radius:12px; padding:0.9rem 1.1rem; margin-top:0.4rem; animation:slide-up 0.4s ease; }
-    .analysis-card .a-header { display:flex; align-items:center; gap:0.5rem; margin-bottom:0.5rem; }
-    .analysis-card .a-title { color:var(--accent); font-size:0.75rem; font-weight:700; letter-spacing:1px; text-transform:uppercase; margin:0; }
-    .analysis-card .a-desc { color:var(--text-primary); font-size:0.82rem; line-height:1.4; margin:0.3rem 0; }
-    .analysis-card .a-telugu { color:var(--text-secondary); font-size:0.78rem; font-style:italic; margin:0.2rem 0; }
-    .action-alert { margin-top:0.4rem; padding:0.35rem 0.7rem; background:rgba(239,68,68,0.08); border:1px solid rgba(239,68,68,0.2); border-radius:8px; color:var(--danger); font-size:0.75rem; font-weight:600; animation:border-pulse 2s infinite; }
-
-    .cam-off { background:var(--bg-glass); backdrop-filter:blur(12px); border-radius:14px; padding:50px 20px; text-align:center; border:1px solid var(--border); }
-    .cam-off h3 { margin:0; font-weight:700; }
-    .cam-off p { color:var(--text-muted); margin:0.3rem 0 0 0; font-size:0.85rem; }
-
-    .motion-bar { background:var(--bg-glass); backdrop-filter:blur(12px); border-radius:8px; padding:0.35rem 0.7rem; font-size:0.7rem; color:var(--text-secondary); border:1px solid var(--border); font-family:'JetBrains Mono',monospace; margin-top:0.3rem; }
-
-    .feed-header { display:flex; align-items:center; justify-content:space-between; margin-bottom:0.5rem; }
-    .feed-title { color:var(--text-primary); font-size:0.85rem; font-weight:700; margin:0; }
-    .feed-count { color:var(--text-muted); font-size:0.65rem; font-family:'JetBrains Mono',monospace; }
-
-    .section-label { color:var(--text-muted); font-size:0.6rem; font-weight:600; letter-spacing:2px; text-transform:uppercase; margin-bottom:0.3rem; }
-
-    #MainMenu{visibility:hidden} footer{visibility:hidden} .stDeployButton{display:none}
-    header[data-testid="stHeader"]{background:transparent}
-    section[data-testid="stSidebar"]{background:rgba(3,7,18,0.95); backdrop-filter:blur(20px); border-right:1px solid var(--border);}
-</style>
-""", unsafe_allow_html=True)
+# Streamlit drops elements a run doesn't emit, so the (cached) style block is
+# still written on every run.
+st.markdown(load_css(), unsafe_allow_html=True)
 
 
 # ---------------------------------------------------------------------------
@@ -283,7 +290,7 @@ st.markdown("""
 # ---------------------------------------------------------------------------
 def init_session_state():
     defaults = {
-        "monitoring": False, "camera": None, "prev_frame": None,
+        "monitoring": False, "camera": None, "prev_frame": None,  # prev_frame: grayscale
         "events_log": [], "total_analyses": 0, "motion_events": 0,
         "source_type": "local_cam", "video_file_path": None,
         "last_analysis_result": None, "analyzer": BackgroundAnalyzer(),
@@ -294,50 +301,252 @@ def init_session_state():
             st.session_state[key] = val
 
 init_session_state()
+init_db()  # no-op after the first run in this process
 
 
 # ---------------------------------------------------------------------------
 # Camera management (OpenCV — for local camera & video files)
 # ---------------------------------------------------------------------------
+# Uploaded videos go to tmpfs when available (Linux /dev/shm), so OpenCV
+# reads them back from memory rather than disk.
+UPLOAD_DIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+def write_upload(uploaded, directory) -> str:
+    """Copy an upload into a temp file in `directory`; returns its path."""
+    # getbuffer() is a view of the upload, so it is written without an extra copy;
+    # the file is closed on exit so OpenCV can open it on Windows
+    tfile = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", dir=directory)
+    try:
+        with tfile:
+            tfile.write(uploaded.getbuffer())
+    except OSError:
+        os.remove(tfile.name)  # don't leave a partial copy behind
+        raise
+    return tfile.name
+
+def stage_upload(uploaded) -> str:
+    """
+    Write an upload where OpenCV can open it: tmpfs if it has room (Docker
+    gives /dev/shm only 64 MB), else the default temp dir.
+    """
+    if UPLOAD_DIR:
+        try:
+            if shutil.disk_usage(UPLOAD_DIR).free > uploaded.size:
+                return write_upload(uploaded, UPLOAD_DIR)
+        except OSError:
+            pass
+    return write_upload(uploaded, None)
+
+def discard_upload():
+    """Delete the staged copy of the upload (it may be in tmpfs, i.e. RAM)."""
+    path = st.session_state.video_file_path
+    st.session_state.video_file_path = None
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 def open_camera(source=0):
-    if st.session_state.camera is not None:
-        st.session_state.camera.release()
-    cap = cv2.VideoCapture(source)
+    release_camera()
+    is_device = st.session_state.source_type == "local_cam"
+    # On Windows, DirectShow honours the FOURCC/size requests below (the
+    # default MSMF backend mostly ignores them)
+    if is_device and os.name == "nt":
+        cap = cv2.VideoCapture(source, cv2.CAP_DSHOW)
+    else:
+        cap = cv2.VideoCapture(source)
     if not cap.isOpened():
         st.error(f"❌ Failed to open: {source}")
         return False
-    st.session_state.camera = cap
+    if is_device:
+        # Keep at most one frame queued in the driver (the capture thread only
+        # wants the newest), ask for compressed MJPG over USB, and capture at
+        # the processing size so frames aren't shipped large only to be
+        # downscaled. Backends that don't support a property just ignore it.
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, TARGET_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, TARGET_HEIGHT)
+    capture = CaptureThread(cap, loop=st.session_state.source_type == "video")
+    capture.start()
+    st.session_state.camera = capture
     st.session_state.prev_frame = None
     return True
 
 def release_camera():
     if st.session_state.camera is not None:
-        st.session_state.camera.release()
+        st.session_state.camera.stop()
         st.session_state.camera = None
         st.session_state.prev_frame = None
 
+def stop_monitoring():
+    """STOP button callback — runs before the rerun, so a running video loop exits."""
+    st.session_state.monitoring = False
+    release_camera()
+    discard_upload()
+
 def read_frame():
+    """
+    Newest preprocessed (640x480 BGR) frame from the capture thread, or None
+    if none arrived within the wait (see capture_ended()).
+    """
     if st.session_state.camera is None:
         return None
-    ret, frame = st.session_state.camera.read()
-    if not ret:
-        if st.session_state.source_type == "video":
-            st.session_state.camera.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            ret, frame = st.session_state.camera.read()
-            if not ret: return None
-        else:
-            return None
-    return frame
+    return st.session_state.camera.next_frame()
+
+def capture_ended() -> bool:
+    """True if there is no capture thread or its stream is over."""
+    return st.session_state.camera is None or st.session_state.camera.ended
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
+# Keyed on database.events_version(), so a new event is picked up as soon as
+# it's flushed; the TTL only covers writes from other processes (Postgres).
+@st.cache_data(ttl=2.0, max_entries=4, show_spinner=False)
+def cached_event_stats(version: int):
+    return get_event_stats()
+
+
+@st.cache_data(ttl=2.0, max_entries=8, show_spinner=False)
+def cached_recent_events(version: int, limit: int):
+    return get_recent_events(limit=limit)
+
+
+@st.cache_data(ttl=2.0, max_entries=8, show_spinner=False)
+def cached_events_before(version: int, cursor_id, limit: int):
+    return get_events_before(cursor_id, limit)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def event_thumbnail(event_id: int, image_path: str) -> bytes:
+    """JPEG bytes of an event snapshot; snapshots never change, so read each once."""
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+# Header in its two states (live / standby), built once
+HEADER_TMPL = """
+<div class="aegis-header">
+    <div class="logo-group">
+        <span class="shield">🛡️</span>
+        <div>
+            <h1>AEGIS</h1>
+            <p class="tagline">AI-Powered Surveillance</p>
+        </div>
+    </div>
+    {badge}
+</div>
+"""
+HEADER_HTML = {
+    True: HEADER_TMPL.format(badge='<div class="live-badge active"><span class="dot"></span>LIVE</div>'),
+    False: HEADER_TMPL.format(badge='<div class="live-badge paused">⏸ STANDBY</div>'),
+}
+
+STATS_TMPL = """
+<div class="stats-row">
+    <div class="stat-card"><p class="val c-cyan">{total}</p><p class="lbl">Total</p></div>
+    <div class="stat-card"><p class="val c-red">{high}</p><p class="lbl">Critical</p></div>
+    <div class="stat-card"><p class="val c-yellow">{medium}</p><p class="lbl">Warnings</p></div>
+    <div class="stat-card"><p class="val c-green">{low}</p><p class="lbl">Normal</p></div>
+</div>
+"""
+
+FEED_HEADER_TMPL = """
+<div class="feed-header">
+<p class="feed-title">📋 Activity Feed</p>
+<span class="feed-count">{count} events</span>
+</div>
+"""
+
+EVENT_CARD_TMPL = """
+<div class="event-card {extra_cls}">
+<div style="display:flex; justify-content:space-between; align-items:center; margin-bottom:0.25rem;">
+{badge}
+<span style="color:var(--text-muted); font-size:0.65rem; font-family:'JetBrains Mono',monospace;">{timestamp}</span>
+</div>
+<p style="margin:0; color:var(--text-primary); font-size:0.78rem; line-height:1.35;">{description}</p>
+</div>
+"""
+
+FEED_EMPTY_HTML = '<div class="cam-off" style="padding:2rem;"><p style="color:var(--text-muted); margin:0;">No events yet. Start monitoring to begin.</p></div>'
+
+
+def render_event_card(event) -> str:
+    """HTML for one Activity Feed entry."""
+    level = event.get("threat_level", "low")
+    return EVENT_CARD_TMPL.format(
+        extra_cls="high-event" if level.lower() == "high" else "",
+        badge=threat_badge(level),
+        timestamp=event.get("timestamp", ""),
+        description=event.get("description", "No description"),
+    )
+
+
+FEED_THUMBNAILS = 3  # the newest events show their snapshot
+
+
+def render_feed(event_list) -> list:
+    """
+    The Activity Feed as a list of ("html", markup) and ("thumb", (event_id,
+    image_path)) parts, for show_feed(). Consecutive cards share one HTML part.
+    """
+    html = FEED_HEADER_TMPL.format(count=len(event_list))
+    if not event_list:
+        return [("html", html + FEED_EMPTY_HTML)]
+    parts = []
+    for idx, event in enumerate(event_list):
+        html += render_event_card(event)
+        if idx < FEED_THUMBNAILS and event.get("image_path"):
+            parts.append(("html", html))
+            parts.append(("thumb", (event["id"], event["image_path"])))
+            html = ""
+    if html:
+        parts.append(("html", html))
+    return parts
+
+
+def show_feed(parts):
+    """
+    Emit the parts from render_feed(). Thumbnails go through st.image, which
+    serves them by a content-addressed URL the browser caches, so a rerun
+    resends only that URL rather than the image.
+    """
+    for kind, value in parts:
+        if kind == "html":
+            st.markdown(value, unsafe_allow_html=True)
+        else:
+            try:
+                st.image(event_thumbnail(*value), width=150)
+            except OSError:
+                pass  # snapshot file missing
+
+
+def emit_html(placeholder, html: str, emitted: dict):
+    """
+    placeholder.markdown(html), skipped when it already shows exactly this
+    HTML. `emitted` must be scoped to the current run, since a rerun clears
+    every placeholder.
+    """
+    if emitted.get(id(placeholder)) != html:
+        placeholder.markdown(html, unsafe_allow_html=True)
+        emitted[id(placeholder)] = html
+
+
+# Badge HTML depends only on the lowercased level, so the three known badges
+# are built once.
+_BADGES = {
+    l: f'<span class="badge badge-{l}">{emoji} {l.upper()}</span>'
+    for l, emoji in (("high", "🔴"), ("medium", "🟡"), ("low", "🟢"))
+}
+
 def threat_badge(level: str) -> str:
-    l = level.lower()
-    cls = f"badge-{l}" if l in ("high", "medium", "low") else "badge-low"
-    emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}.get(l, "⚪")
-    return f'<span class="badge {cls}">{emoji} {level.upper()}</span>'
+    badge = _BADGES.get(level) or _BADGES.get(level.lower())
+    if badge is None:
+        badge = f'<span class="badge badge-low">⚪ {level.upper()}</span>'
+    return badge
 
 
 def render_analysis_card(result):
@@ -363,27 +572,27 @@ def render_analysis_card(result):
     """
 
 
+LIVE_REFRESH = 1.0  # seconds between live status redraws in browser-camera mode
+
+def show_live_status():
+    """Status bar, motion chart and latest analysis from the WebRTC worker's SharedState."""
+    lbl, mscore, freason = shared.get_status()
+    st.markdown(f'<div class="motion-bar">{lbl} &nbsp;│&nbsp; Motion: {mscore:.1%} &nbsp;│&nbsp; {freason}</div>', unsafe_allow_html=True)
+
+    last_r, _ = shared.get_result()
+    if last_r:
+        st.markdown(render_analysis_card(last_r), unsafe_allow_html=True)
+
+    motion_hist = shared.motion_history()
+    if len(motion_hist):
+        st.line_chart(motion_hist, height=120)
+
+
 # ---------------------------------------------------------------------------
 # HEADER
 # ---------------------------------------------------------------------------
 is_active = st.session_state.monitoring or st.session_state.source_type in ("local_cam", "browser_cam")
-if is_active and st.session_state.monitoring:
-    badge = '<div class="live-badge active"><span class="dot"></span>LIVE</div>'
-else:
-    badge = '<div class="live-badge paused">⏸ STANDBY</div>'
-
-st.markdown(f"""
-<div class="aegis-header">
-    <div class="logo-group">
-        <span class="shield">🛡️</span>
-        <div>
-            <h1>AEGIS</h1>
-            <p class="tagline">AI-Powered Surveillance</p>
-        </div>
-    </div>
-    {badge}
-</div>
-""", unsafe_allow_html=True)
+st.markdown(HEADER_HTML[bool(is_active and st.session_state.monitoring)], unsafe_allow_html=True)
 
 
 # ---------------------------------------------------------------------------
@@ -414,11 +623,8 @@ with st.sidebar:
             # Only write the file once per unique upload (avoid re-reading consumed buffer on rerun)
             upload_key = f"{uploaded.name}_{uploaded.size}"
             if st.session_state.get("_last_upload_key") != upload_key:
-                tfile = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-                tfile.write(uploaded.read())
-                tfile.flush()
-                tfile.close()  # Close so OpenCV can open it on Windows
-                st.session_state.video_file_path = tfile.name
+                # A new upload replaces the previous one's staged copy
+                discard_upload()
                 st.session_state._last_upload_key = upload_key
                 st.success(f"✅ {uploaded.name}")
 
@@ -432,12 +638,14 @@ with st.sidebar:
                 st.session_state.monitoring = True
                 if st.session_state.source_type == "local_cam":
                     open_camera(camera_index)
-                elif st.session_state.video_file_path:
+                elif uploaded:
+                    # Staged on START and deleted on STOP, so the copy only
+                    # exists while the video is playing
+                    if not st.session_state.video_file_path:
+                        st.session_state.video_file_path = stage_upload(uploaded)
                     open_camera(st.session_state.video_file_path)
         with col_stop:
-            if st.button("■ STOP", use_container_width=True):
-                st.session_state.monitoring = False
-                release_camera()
+            st.button("■ STOP", use_container_width=True, on_click=stop_monitoring)
 
     st.markdown("---")
     use_mock = st.checkbox("Mock mode (no API)", value=not is_claude_configured())
@@ -449,15 +657,8 @@ with st.sidebar:
 # ---------------------------------------------------------------------------
 # STATS
 # ---------------------------------------------------------------------------
-stats = get_event_stats()
-st.markdown(f"""
-<div class="stats-row">
-    <div class="stat-card"><p class="val c-cyan">{stats['total']}</p><p class="lbl">Total</p></div>
-    <div class="stat-card"><p class="val c-red">{stats['high']}</p><p class="lbl">Critical</p></div>
-    <div class="stat-card"><p class="val c-yellow">{stats['medium']}</p><p class="lbl">Warnings</p></div>
-    <div class="stat-card"><p class="val c-green">{stats['low']}</p><p class="lbl">Normal</p></div>
-</div>
-""", unsafe_allow_html=True)
+stats = cached_event_stats(events_version())
+st.markdown(STATS_TMPL.format_map(stats), unsafe_allow_html=True)
 
 
 # ---------------------------------------------------------------------------
@@ -468,70 +669,13 @@ col_camera, col_feed = st.columns([3, 2])
 with col_camera:
 
     # ===== MODE A: Local Camera (OpenCV) — works with Iriun/USB =====
+    # Like Mode C, frames are drawn by the FRAME LOOP at the bottom of the script.
     if st.session_state.source_type == "local_cam":
         camera_placeholder = st.empty()
         motion_info = st.empty()
         analysis_result_box = st.empty()
 
-        if st.session_state.monitoring:
-            frame = read_frame()
-            if frame is not None:
-                processed = preprocess_frame(frame)
-                motion = detect_motion(st.session_state.prev_frame, processed)
-                motion_score = get_motion_score(st.session_state.prev_frame, processed)
-                should_analyze, filter_reason, bboxes = should_call_claude(st.session_state.prev_frame, processed)
-
-                analyzer = st.session_state.analyzer
-                bg_result, bg_b64 = analyzer.get_result()
-                if bg_result and "error" not in bg_result:
-                    st.session_state.last_analysis_result = bg_result
-                    st.session_state.total_analyses += 1
-                    log_event(bg_result.get("threat_level", "low"), bg_result.get("description", "No description"), bg_b64 or "")
-                    if bg_result.get("threat_level", "").lower() == "high":
-                        send_high_threat_alert(bg_result.get("description", ""), bg_result.get("description_telugu", ""), bg_result.get("action_needed", ""))
-                elif bg_result and "error" in bg_result:
-                    analysis_result_box.warning(f"Analysis error: {bg_result['error']}")
-
-                display_frame = processed.copy()
-                is_analyzing = analyzer.is_busy
-                if is_analyzing:
-                    status_text, status_color, s_label = "ANALYZING...", (248, 189, 56), "🟠 Analyzing"
-                elif should_analyze:
-                    status_text, status_color, s_label = f"DETECTED: {filter_reason}", (68, 68, 239), "🔴 Sending"
-                elif motion:
-                    status_text, status_color, s_label = f"MOTION ({filter_reason})", (11, 158, 245), "🟡 Motion"
-                else:
-                    status_text, status_color, s_label = "MONITORING", (16, 185, 129), "🟢 Stable"
-
-                display_frame = draw_status_overlay(display_frame, status_text, status_color)
-                display_frame = draw_motion_border(display_frame, motion)
-                if bboxes:
-                    display_frame = draw_bounding_boxes(display_frame, bboxes)
-
-                display_rgb = cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)
-                camera_placeholder.image(display_rgb, channels="RGB", use_container_width=True)
-
-                motion_info.markdown(
-                    f'<div class="motion-bar">{s_label} &nbsp;│&nbsp; Motion: {motion_score:.1%} &nbsp;│&nbsp; {filter_reason}</div>',
-                    unsafe_allow_html=True,
-                )
-
-                if should_analyze and not analyzer.is_busy:
-                    st.session_state.motion_events += 1
-                    analyzer.submit(processed, use_mock=use_mock)
-
-                last = st.session_state.last_analysis_result
-                if last:
-                    analysis_result_box.markdown(render_analysis_card(last), unsafe_allow_html=True)
-
-                st.session_state.prev_frame = processed.copy()
-                elapsed = time.time() - st.session_state.frame_time
-                time.sleep(max(0.05, 0.2 - elapsed))
-                st.session_state.frame_time = time.time()
-                st.rerun()
-            else:
-                camera_placeholder.markdown('<div class="cam-off"><h3 style="color:var(--danger);">⚠️ No Frame</h3><p>Check your camera connection.</p></div>', unsafe_allow_html=True)
-        else:
+        if not st.session_state.monitoring:
             camera_placeholder.markdown('<div class="cam-off"><h3 style="color:var(--accent);">🛡️ Aegis Ready</h3><p>Press ▶ START to begin monitoring.</p></div>', unsafe_allow_html=True)
 
     # ===== MODE B: Browser Camera (WebRTC) — for cloud =====
@@ -550,81 +694,19 @@ with col_camera:
             ctx.video_processor.set_shared(shared)
             ctx.video_processor.use_mock = use_mock
 
-        status_ph = st.empty()
-        analysis_ph = st.empty()
-
-        lbl, mscore, freason = shared.get_status()
-        status_ph.markdown(f'<div class="motion-bar">{lbl} &nbsp;│&nbsp; Motion: {mscore:.1%} &nbsp;│&nbsp; {freason}</div>', unsafe_allow_html=True)
-
-        last_r, _ = shared.get_result()
-        if last_r:
-            analysis_ph.markdown(render_analysis_card(last_r), unsafe_allow_html=True)
+        # Nothing reruns the script while the stream plays, so the status
+        # redraws itself as a fragment, once per LIVE_REFRESH while playing
+        st.fragment(show_live_status, run_every=LIVE_REFRESH if ctx.state.playing else None)()
 
     # ===== MODE C: Video File =====
+    # Frames are drawn by the FRAME LOOP at the bottom of the script, which
+    # updates these placeholders in place instead of rerunning per frame.
     elif st.session_state.source_type == "video":
         camera_placeholder = st.empty()
         motion_info = st.empty()
         analysis_result_box = st.empty()
 
-        if st.session_state.monitoring:
-            frame = read_frame()
-            if frame is not None:
-                processed = preprocess_frame(frame)
-                motion = detect_motion(st.session_state.prev_frame, processed)
-                motion_score = get_motion_score(st.session_state.prev_frame, processed)
-                should_analyze, filter_reason, bboxes = should_call_claude(st.session_state.prev_frame, processed)
-
-                analyzer = st.session_state.analyzer
-                bg_result, bg_b64 = analyzer.get_result()
-                if bg_result and "error" not in bg_result:
-                    st.session_state.last_analysis_result = bg_result
-                    st.session_state.total_analyses += 1
-                    log_event(bg_result.get("threat_level", "low"), bg_result.get("description", "No description"), bg_b64 or "")
-                    if bg_result.get("threat_level", "").lower() == "high":
-                        send_high_threat_alert(bg_result.get("description", ""), bg_result.get("description_telugu", ""), bg_result.get("action_needed", ""))
-                elif bg_result and "error" in bg_result:
-                    analysis_result_box.warning(f"Analysis error: {bg_result['error']}")
-
-                display_frame = processed.copy()
-                is_analyzing = analyzer.is_busy
-                if is_analyzing:
-                    status_text, status_color, s_label = "ANALYZING...", (248, 189, 56), "🟠 Analyzing"
-                elif should_analyze:
-                    status_text, status_color, s_label = f"DETECTED: {filter_reason}", (68, 68, 239), "🔴 Sending"
-                elif motion:
-                    status_text, status_color, s_label = f"MOTION ({filter_reason})", (11, 158, 245), "🟡 Motion"
-                else:
-                    status_text, status_color, s_label = "MONITORING", (16, 185, 129), "🟢 Stable"
-
-                display_frame = draw_status_overlay(display_frame, status_text, status_color)
-                display_frame = draw_motion_border(display_frame, motion)
-                if bboxes:
-                    display_frame = draw_bounding_boxes(display_frame, bboxes)
-
-                display_rgb = cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)
-                camera_placeholder.image(display_rgb, channels="RGB", use_container_width=True)
-
-                motion_info.markdown(
-                    f'<div class="motion-bar">{s_label} &nbsp;│&nbsp; Motion: {motion_score:.1%} &nbsp;│&nbsp; {filter_reason}</div>',
-                    unsafe_allow_html=True,
-                )
-
-                if should_analyze and not analyzer.is_busy:
-                    st.session_state.motion_events += 1
-                    analyzer.submit(processed, use_mock=use_mock)
-
-                last = st.session_state.last_analysis_result
-                if last:
-                    analysis_result_box.markdown(render_analysis_card(last), unsafe_allow_html=True)
-
-                st.session_state.prev_frame = processed.copy()
-                elapsed = time.time() - st.session_state.frame_time
-                time.sleep(max(0.05, 0.2 - elapsed))
-                st.session_state.frame_time = time.time()
-                st.rerun()
-            else:
-                camera_placeholder.markdown('<div class="cam-off"><h3 style="color:var(--danger);">⚠️ No Frame</h3><p>Check your video file.</p></div>', unsafe_allow_html=True)
-        else:
+        if not st.session_state.monitoring:
             camera_placeholder.markdown('<div class="cam-off"><h3 style="color:var(--accent);">🛡️ Aegis Ready</h3><p>Upload a video and press ▶ START.</p></div>', unsafe_allow_html=True)
 
     else:
@@ -633,64 +715,150 @@ with col_camera:
 
 # ----- RIGHT: Activity Feed -----
 with col_feed:
-    event_list = get_recent_events(limit=10)
-    count = len(event_list) if event_list else 0
+    event_list = cached_recent_events(events_version(), 10) or []
 
-    st.markdown(f"""
-    <div class="feed-header">
-        <p class="feed-title">📋 Activity Feed</p>
-        <span class="feed-count">{count} events</span>
-    </div>
-    """, unsafe_allow_html=True)
-
-    if event_list:
-        for idx, event in enumerate(event_list):
-            level = event.get("threat_level", "low")
-            badge_html = threat_badge(level)
-            desc = event.get("description", "No description")
-            ts = event.get("timestamp", "")
-            extra_cls = "high-event" if level.lower() == "high" else ""
-
-            st.markdown(f"""
-            <div class="event-card {extra_cls}">
-                <div style="display:flex; justify-content:space-between; align-items:center; margin-bottom:0.25rem;">
-                    {badge_html}
-                    <span style="color:var(--text-muted); font-size:0.65rem; font-family:'JetBrains Mono',monospace;">{ts}</span>
-                </div>
-                <p style="margin:0; color:var(--text-primary); font-size:0.78rem; line-height:1.35;">{desc}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-            if idx < 3 and event.get("image_data"):
-                try:
-                    img_bytes = base64.b64decode(event["image_data"])
-                    img = Image.open(BytesIO(img_bytes))
-                    st.image(img, width=150)
-                except Exception:
-                    pass
-    else:
-        st.markdown('<div class="cam-off" style="padding:2rem;"><p style="color:var(--text-muted); margin:0;">No events yet. Start monitoring to begin.</p></div>', unsafe_allow_html=True)
+    # The feed's parts are rebuilt only when the set of events changes
+    feed_sig = tuple(e["id"] for e in event_list)
+    if feed_sig != st.session_state.get("_feed_sig"):
+        st.session_state._feed_parts = render_feed(event_list)
+        st.session_state._feed_sig = feed_sig
+    show_feed(st.session_state._feed_parts)
 
 
 # ---------------------------------------------------------------------------
 # SECURITY LOG
 # ---------------------------------------------------------------------------
 st.markdown("---")
-with st.expander("🗂️ Security Log", expanded=False):
-    all_events = get_recent_events(limit=50)
+# A toggle instead of an expander: an expander's body runs (and its table is
+# built and sent) on every rerun even while collapsed; this one only when open.
+LOG_PAGE_SIZE = 50
+
+def log_older(cursor_id: int):
+    """Callback for the 'Older' button: page past the last event shown."""
+    st.session_state._log_cursors.append(cursor_id)
+
+def log_newer():
+    """Callback for the 'Newer' button: back to the previous page."""
+    st.session_state._log_cursors.pop()
+
+if st.toggle("🗂️ Security Log", value=False, key="_log_open"):
+    # Keyset paging: each page starts below the last id of the page before it
+    cursors = st.session_state.setdefault("_log_cursors", [])
+    all_events = cached_events_before(events_version(), cursors[-1] if cursors else None, LOG_PAGE_SIZE)
     if all_events:
-        import pandas as pd
-        df = pd.DataFrame(all_events)[["id", "timestamp", "threat_level", "description"]]
-        df.columns = ["ID", "Timestamp", "Threat", "Description"]
-        st.dataframe(df, use_container_width=True, hide_index=True, column_config={
+        # Arrow table built column-wise from the rows; st.dataframe serializes
+        # it as-is, without a pandas round-trip. pyarrow is imported only here,
+        # so a run with the log closed never loads it.
+        import pyarrow as pa
+        log_table = pa.table({
+            label: [e[key] for e in all_events]
+            for label, key in (("ID", "id"), ("Timestamp", "timestamp"), ("Threat", "threat_level"), ("Description", "description"))
+        })
+        st.dataframe(log_table, use_container_width=True, hide_index=True, column_config={
             "Threat": st.column_config.TextColumn(width="small"),
             "Description": st.column_config.TextColumn(width="large"),
         })
     else:
         st.info("No events yet.")
+    if cursors or len(all_events) == LOG_PAGE_SIZE:
+        col_newer, col_older = st.columns(2)
+        col_newer.button("◀ Newer", use_container_width=True, disabled=not cursors, on_click=log_newer)
+        col_older.button("Older ▶", use_container_width=True, disabled=len(all_events) < LOG_PAGE_SIZE,
+                         on_click=log_older, args=(all_events[-1]["id"] if all_events else 0,))
 
 st.markdown("---")
 f1, f2, f3 = st.columns(3)
 with f1: st.caption(f"🧠 Analyses: {st.session_state.total_analyses}")
 with f2: st.caption(f"⚡ Detections: {st.session_state.motion_events}")
 with f3: st.caption("🛡️ Aegis v2.0")
+
+
+# ---------------------------------------------------------------------------
+# FRAME LOOP (Modes A & C) — runs last so the feed and log above are already
+# drawn. Placeholders are updated in place; the script only reruns when a new
+# analysis was logged (to refresh stats/feed) or the STOP callback fires.
+# ---------------------------------------------------------------------------
+DISPLAY_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 75]
+
+
+def run_capture_loop(camera_placeholder, motion_info, analysis_result_box, use_mock: bool):
+    """
+    Shared frame loop of Modes A & C: pull frames from the capture thread and
+    update the given placeholders until monitoring stops or the stream ends.
+    """
+    analyzer = st.session_state.analyzer
+    # Spare grayscale buffer that ping-pongs with prev_frame
+    gray_spare = None
+    last_view_key = None  # what the camera placeholder currently shows
+    emitted = {}  # placeholder id -> HTML last sent this run; unchanged HTML isn't resent
+    no_frame_hint = "Check your camera connection." if st.session_state.source_type == "local_cam" else "Check your video file."
+    while st.session_state.monitoring:
+        frame = read_frame()
+        if frame is None:
+            if not capture_ended():
+                continue  # slow or stalled source (camera warm-up, USB hiccup): keep waiting
+            camera_placeholder.markdown(f'<div class="cam-off"><h3 style="color:var(--danger);">⚠️ No Frame</h3><p>{no_frame_hint}</p></div>', unsafe_allow_html=True)
+            break
+
+        processed = frame  # already preprocessed by the capture thread, and ours to draw on
+        gray = to_gray(processed, out=gray_spare)
+        should_analyze, filter_reason, bboxes, motion, motion_score = should_call_claude(st.session_state.prev_frame, gray)
+
+        new_event = False
+        bg_result, bg_jpeg = analyzer.get_result()
+        if bg_result and "error" not in bg_result:
+            st.session_state.last_analysis_result = bg_result
+            st.session_state.total_analyses += 1
+            log_event(bg_result.get("threat_level", "low"), bg_result.get("description", "No description"), bg_jpeg)
+            if bg_result.get("threat_level", "").lower() == "high":
+                send_high_threat_alert(bg_result.get("description", ""), bg_result.get("description_telugu", ""), bg_result.get("action_needed", ""))
+            new_event = True
+        elif bg_result and "error" in bg_result:
+            analysis_result_box.warning(f"Analysis error: {bg_result['error']}")
+            emitted.pop(id(analysis_result_box), None)
+
+        status_text, status_color, s_label = frame_status(analyzer.is_busy, should_analyze, motion, filter_reason)
+
+        # Hand the clean frame to the analyzer (it keeps its own copy) before
+        # the overlays are drawn into the same buffer. Candidates arriving while
+        # a batch is collecting join it; submit() ignores them once it runs.
+        if should_analyze:
+            if analyzer.submit(processed, use_mock=use_mock):
+                st.session_state.motion_events += 1
+
+        # Skip the draw/encode/send when nothing visible changed: same 8x8
+        # mean-hash of the scene, same overlays, same timestamp second.
+        thumb = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+        view_key = ((thumb > thumb.mean()).tobytes(), status_text, motion, tuple(map(tuple, bboxes)), int(time.time()))
+        if view_key != last_view_key:
+            last_view_key = view_key
+            draw_hud(processed, status_text, status_color, motion, bboxes)
+
+            # JPEG-encode the BGR frame ourselves; st.image serves the bytes as-is
+            # (no RGB swap, no PIL round-trip, much smaller than PNG). Shown at its
+            # native 640px width (capped to the column) rather than stretched to
+            # the container, so the browser doesn't rescale every frame.
+            _, jpeg = cv2.imencode(".jpg", processed, DISPLAY_JPEG_PARAMS)
+            camera_placeholder.image(jpeg.tobytes())
+
+        emit_html(motion_info, f'<div class="motion-bar">{s_label} &nbsp;│&nbsp; Motion: {motion_score:.1%} &nbsp;│&nbsp; {filter_reason}</div>', emitted)
+
+        last = st.session_state.last_analysis_result
+        if last:
+            emit_html(analysis_result_box, render_analysis_card(last), emitted)
+
+        gray_spare, st.session_state.prev_frame = st.session_state.prev_frame, gray
+
+        if new_event:
+            # Write everything queued since the last rerun in one transaction,
+            # then refresh stats/feed with the new event(s)
+            flush_events()
+            st.rerun()
+
+        elapsed = time.time() - st.session_state.frame_time
+        time.sleep(max(0.05, 0.2 - elapsed))
+        st.session_state.frame_time = time.time()
+
+
+if st.session_state.source_type in ("local_cam", "video"):
+    run_capture_loop(camera_placeholder, motion_info, analysis_result_box, use_mock)
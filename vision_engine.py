@@ -9,16 +9,21 @@ Key optimizations:
 
 import os
 import time
-import base64
 import json
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from dotenv import load_dotenv
 
-load_dotenv(override=True)
+from config import ANTHROPIC_API_KEY, base64
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
+# OpenCV's internal worker pool: our frames are small (640x480) and the capture,
+# analyzer and WebRTC threads already run side by side, so fanning every
+# resize/cvtColor out over all cores costs more in wake-ups than it saves.
+CV_THREADS = min(2, os.cpu_count() or 1)
+cv2.setUseOptimized(True)  # SIMD code paths (on by default, but builds can disable it)
+cv2.setNumThreads(CV_THREADS)
 
 # ---------------------------------------------------------------------------
 # Frame pre-processing
@@ -39,63 +44,89 @@ _hog_run_every = 10  # run HOG every 10th frame
 _last_hog_result = (False, [])  # cache last HOG result
 
 
-def preprocess_frame(frame):
-    """Resize to 640x480 and return the processed frame."""
+def preprocess_frame(frame, out=None):
+    """
+    Resize to 640x480 and return the processed frame.
+    If `out` is a 640x480 array of the same dtype, the result is written into it.
+    """
     if frame is None:
         return None
-    return cv2.resize(frame, (TARGET_WIDTH, TARGET_HEIGHT))
+    return cv2.resize(frame, (TARGET_WIDTH, TARGET_HEIGHT), dst=out)
+
+
+def tile_frames(frames):
+    """
+    Tile up to four frames into a 2x2 grid (time order: left-to-right,
+    top-to-bottom; missing tiles are black) scaled back to 640x480.
+    """
+    tiles = list(frames[:4])
+    tiles += [np.zeros_like(tiles[0])] * (4 - len(tiles))
+    grid = cv2.vconcat([cv2.hconcat(tiles[:2]), cv2.hconcat(tiles[2:])])
+    return cv2.resize(grid, (TARGET_WIDTH, TARGET_HEIGHT), interpolation=cv2.INTER_AREA)
+
+
+def frame_to_jpeg(frame) -> bytes:
+    """Encode a frame as JPEG (70% quality) → raw bytes."""
+    if frame is None:
+        return b""
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    _, buffer = cv2.imencode(".jpg", frame, encode_params)
+    return buffer.tobytes()
 
 
 def frame_to_base64(frame) -> str:
     """Encode a frame as JPEG (70% quality) → Base64 string."""
     if frame is None:
         return ""
-    encode_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
-    _, buffer = cv2.imencode(".jpg", frame, encode_params)
-    return base64.b64encode(buffer).decode("utf-8")
+    return base64.b64encode(frame_to_jpeg(frame)).decode("utf-8")
 
 
 # ---------------------------------------------------------------------------
 # Motion detection (smart sampling)
 # ---------------------------------------------------------------------------
 
-def detect_motion(prev_frame, curr_frame) -> bool:
+def to_gray(frame, out=None):
     """
-    Compare two grayscale frames. Return True if more than MOTION_THRESHOLD
-    fraction of pixels changed.
+    Return a single-channel uint8 view of the frame for the gating pipeline.
+    Frames that are already grayscale pass through unchanged.
+    """
+    if frame is None or frame.ndim == 2:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out)
+
+
+def motion_stats(prev_frame, curr_frame) -> tuple:
+    """
+    Single pass over both frames: grayscale, absolute difference, threshold
+    and count. Accepts BGR or (cheaper) already-grayscale frames.
+    Returns (motion_detected, changed_fraction), where motion is detected if
+    more than MOTION_THRESHOLD of the pixels changed.
     """
     if prev_frame is None or curr_frame is None:
-        return True  # first frame → always process
+        return True, 1.0  # first frame → always process
 
-    # Convert to grayscale
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    curr_gray = cv2.cvtColor(curr_frame, cv2.COLOR_BGR2GRAY)
+    prev_gray = to_gray(prev_frame)
+    curr_gray = to_gray(curr_frame)
 
-    # Absolute difference + threshold
+    # Absolute difference + threshold, reusing the diff buffer
     diff = cv2.absdiff(prev_gray, curr_gray)
-    _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
+    cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY, dst=diff)
 
-    changed_pixels = np.count_nonzero(thresh)
-    total_pixels = thresh.shape[0] * thresh.shape[1]
-    change_ratio = changed_pixels / total_pixels
+    change_ratio = cv2.countNonZero(diff) / diff.size
+    return change_ratio > MOTION_THRESHOLD, change_ratio
 
-    return change_ratio > MOTION_THRESHOLD
+
+def detect_motion(prev_frame, curr_frame) -> bool:
+    """
+    Compare two grayscale frames. Return True if more than MOTION_THRESHOLD
+    fraction of pixels changed.
+    """
+    return motion_stats(prev_frame, curr_frame)[0]
 
 
 def get_motion_score(prev_frame, curr_frame) -> float:
     """Return the fraction of pixels that changed between frames."""
-    if prev_frame is None or curr_frame is None:
-        return 1.0
-
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    curr_gray = cv2.cvtColor(curr_frame, cv2.COLOR_BGR2GRAY)
-
-    diff = cv2.absdiff(prev_gray, curr_gray)
-    _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
-
-    changed_pixels = np.count_nonzero(thresh)
-    total_pixels = thresh.shape[0] * thresh.shape[1]
-    return changed_pixels / total_pixels
+    return motion_stats(prev_frame, curr_frame)[1]
 
 
 # ---------------------------------------------------------------------------
@@ -128,7 +159,7 @@ def detect_person_hog(frame) -> tuple:
     if _hog_frame_counter % _hog_run_every != 0:
         return _last_hog_result
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = to_gray(frame)
     boxes, weights = _hog.detectMultiScale(
         gray, winStride=(8, 8), padding=(4, 4), scale=1.05
     )
@@ -152,8 +183,8 @@ def detect_significant_contours(prev_frame, curr_frame) -> tuple:
     if prev_frame is None or curr_frame is None:
         return True, []
 
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    curr_gray = cv2.cvtColor(curr_frame, cv2.COLOR_BGR2GRAY)
+    prev_gray = to_gray(prev_frame)
+    curr_gray = to_gray(curr_frame)
 
     # Blur to reduce noise
     prev_blur = cv2.GaussianBlur(prev_gray, (21, 21), 0)
@@ -184,37 +215,41 @@ def should_call_claude(prev_frame, curr_frame) -> tuple:
       Layer 2b: HOG person detection (human-shaped object)
       Layer 3: Throttle (5-second cooldown)
 
-    Returns (should_analyze: bool, reason: str, bounding_boxes: list)
+    Every layer works on grayscale, so callers can pass to_gray() frames and
+    keep only the grayscale previous frame.
+
+    Returns (should_analyze: bool, reason: str, bounding_boxes: list,
+             motion: bool, motion_score: float)
     """
     # Layer 1: Basic motion
-    if not detect_motion(prev_frame, curr_frame):
-        return False, "No motion", []
+    motion, motion_score = motion_stats(prev_frame, curr_frame)
+    if not motion:
+        return False, "No motion", [], motion, motion_score
 
     # Layer 2a: Check for large contours (person-sized blobs)
     has_significant, contour_boxes = detect_significant_contours(prev_frame, curr_frame)
     if not has_significant:
-        return False, "Motion too small (shadow/noise)", []
+        return False, "Motion too small (shadow/noise)", [], motion, motion_score
 
     # Layer 2b: HOG person detection (optional boost — if person found, definitely analyze)
     has_person, person_boxes = detect_person_hog(curr_frame)
 
     # Layer 3: Throttle
     if not can_analyze():
-        return False, "Throttled (cooling down)", contour_boxes
+        return False, "Throttled (cooling down)", contour_boxes, motion, motion_score
 
     # Combine boxes for display
     all_boxes = person_boxes if person_boxes else contour_boxes
     reason = "Person detected (HOG)" if has_person else "Large movement detected"
 
-    return True, reason, all_boxes
+    return True, reason, all_boxes, motion, motion_score
 
 
 def draw_bounding_boxes(frame, boxes, color=(0, 255, 255), label="DETECTED"):
     """Draw bounding boxes on frame for detected objects."""
     for (x, y, w, h) in boxes:
         cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-        cv2.putText(frame, label, (x, y - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        _blit_text(frame, label, (x, y - 10), color, 0.5, 2)
     return frame
 
 
@@ -222,27 +257,56 @@ def draw_bounding_boxes(frame, boxes, color=(0, 255, 255), label="DETECTED"):
 # Frame overlay drawing
 # ---------------------------------------------------------------------------
 
+# Rendered text sprites: (text, color, scale, thickness) -> (fill, mask, ascent, pad).
+# Status strings come from a small fixed set; timestamps change once a second,
+# so the cache is simply reset when it grows past _SPRITE_CACHE_MAX.
+_sprite_cache = {}
+_SPRITE_CACHE_MAX = 64
+BANNER_HEIGHT = 50
+
+
+def _text_sprite(text, color, scale, thickness):
+    key = (text, tuple(color), scale, thickness)
+    sprite = _sprite_cache.get(key)
+    if sprite is None:
+        (tw, th), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        pad = thickness + 1
+        mask = np.zeros((th + baseline + 2 * pad, tw + 2 * pad), np.uint8)
+        cv2.putText(mask, text, (pad, th + pad), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness)
+        fill = np.empty(mask.shape + (3,), np.uint8)
+        fill[:] = color
+        if len(_sprite_cache) >= _SPRITE_CACHE_MAX:
+            _sprite_cache.clear()
+        sprite = _sprite_cache[key] = (fill, mask.astype(bool)[..., None], th, pad)
+    return sprite
+
+
+def _blit_text(frame, text, origin, color, scale, thickness):
+    """Equivalent of cv2.putText(frame, text, origin, ...) using a cached sprite."""
+    fill, mask, ascent, pad = _text_sprite(text, color, scale, thickness)
+    x0, y0 = origin[0] - pad, origin[1] - ascent - pad
+    fh, fw = frame.shape[:2]
+    sx, sy = max(0, -x0), max(0, -y0)
+    ex, ey = min(fill.shape[1], fw - x0), min(fill.shape[0], fh - y0)
+    if sx >= ex or sy >= ey:
+        return
+    np.copyto(frame[y0 + sy:y0 + ey, x0 + sx:x0 + ex], fill[sy:ey, sx:ex], where=mask[sy:ey, sx:ex])
+
+
 def draw_status_overlay(frame, status: str = "MONITORING", color=(0, 255, 0)):
-    """Draw a status banner on the frame."""
-    overlay = frame.copy()
+    """Draw a status banner on the frame, in place."""
     h, w = frame.shape[:2]
 
-    # Semi-transparent banner at top
-    cv2.rectangle(overlay, (0, 0), (w, 50), (0, 0, 0), -1)
-    frame = cv2.addWeighted(overlay, 0.6, frame, 0.4, 0)
+    # Semi-transparent banner at top (60% black)
+    banner = frame[:BANNER_HEIGHT + 1]
+    cv2.convertScaleAbs(banner, banner, alpha=0.4)
 
     # Status text
-    cv2.putText(
-        frame, f"AEGIS | {status}",
-        (15, 35), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2
-    )
+    _blit_text(frame, f"AEGIS | {status}", (15, 35), color, 0.7, 2)
 
     # Timestamp
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    cv2.putText(
-        frame, timestamp,
-        (w - 230, 35), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1
-    )
+    _blit_text(frame, timestamp, (w - 230, 35), (200, 200, 200), 0.5, 1)
 
     return frame
 
@@ -256,6 +320,15 @@ def draw_motion_border(frame, motion_detected: bool):
     return frame
 
 
+def draw_hud(frame, status: str, color, motion_detected: bool, boxes=()):
+    """Draw the status banner, motion border and detection boxes, in place."""
+    draw_status_overlay(frame, status, color)
+    draw_motion_border(frame, motion_detected)
+    if len(boxes):
+        draw_bounding_boxes(frame, boxes)
+    return frame
+
+
 # ---------------------------------------------------------------------------
 # Claude 3 Haiku analysis
 # ---------------------------------------------------------------------------
@@ -284,9 +357,11 @@ def can_analyze() -> bool:
     return (time.time() - _last_analysis_time) >= THROTTLE_SECONDS
 
 
-def analyze_frame(frame) -> dict:
+def analyze_frame(frame, img_b64: str = None, frame_count: int = 1) -> dict:
     """
     Send a frame to Claude 3 Haiku for threat analysis.
+    Pass `img_b64` if the frame has already been JPEG/Base64-encoded, to skip
+    re-encoding it. `frame_count` > 1 means `frame` is a tile_frames() grid.
     Returns a dict with threat_level, description, etc.
     Returns None if throttled or unconfigured.
     """
@@ -302,8 +377,16 @@ def analyze_frame(frame) -> dict:
         import anthropic
 
         # Pre-process
-        processed = preprocess_frame(frame)
-        img_b64 = frame_to_base64(processed)
+        if img_b64 is None:
+            img_b64 = frame_to_base64(preprocess_frame(frame))
+
+        if frame_count > 1:
+            prompt = (
+                f"These are {frame_count} consecutive surveillance frames tiled in a 2x2 grid, "
+                "in time order left-to-right, top-to-bottom. What do you see? Assess the threat level."
+            )
+        else:
+            prompt = "Analyze this surveillance frame. What do you see? Assess the threat level."
 
         client = anthropic.Anthropic(
             api_key=ANTHROPIC_API_KEY,
@@ -328,7 +411,7 @@ def analyze_frame(frame) -> dict:
                         },
                         {
                             "type": "text",
-                            "text": "Analyze this surveillance frame. What do you see? Assess the threat level.",
+                            "text": prompt,
                         },
                     ],
                 }
@@ -406,69 +489,211 @@ def analyze_frame_mock(frame) -> dict:
 # Background Analyzer — runs Claude in a separate thread (non-blocking)
 # ---------------------------------------------------------------------------
 
+# One analysis pool for the whole process — every session's analyzer submits
+# here, so concurrent Claude calls are bounded by cores rather than by users.
+ANALYZER_POOL = ThreadPoolExecutor(
+    max_workers=min(4, os.cpu_count() or 1),
+    thread_name_prefix="aegis-analyzer",
+)
+
+
+# Candidate frames are batched: up to BATCH_FRAMES arriving within
+# BATCH_WINDOW seconds of the first one go to Claude as one 2x2 grid.
+BATCH_FRAMES = 4
+BATCH_WINDOW = 0.5
+
+
 class BackgroundAnalyzer:
     """
-    Runs Claude analysis in a background thread so the video feed doesn't freeze.
+    Per-session result mailbox for Claude analysis. The work itself runs on the
+    shared ANALYZER_POOL so the video feed doesn't freeze.
     The main loop checks `get_result()` each frame — if a result is ready, it
-    processes it; if not, the video keeps playing smoothly.
+    processes it; if not, the video keeps playing smoothly. That check (and
+    `is_busy`) is a flag read, so the per-frame poll never takes the lock.
     """
 
     def __init__(self):
         self._result = None
+        self._done = threading.Event()  # set when a result is waiting in _result
         self._pending = False
+        self._collecting = False
         self._lock = threading.Lock()
-        self._frame_b64 = None  # store b64 for logging
+        self._batch = deque(maxlen=BATCH_FRAMES)
+        self._batch_timer = None  # ends the collection window of the current batch
+        self._use_mock = False
+        self._frame_jpeg = None  # JPEG bytes of the analyzed frame, for logging
 
     @property
     def is_busy(self) -> bool:
-        """True if a Claude analysis is currently running in the background."""
-        with self._lock:
-            return self._pending
+        """True from the first frame of a batch until its analysis finishes."""
+        return self._collecting or self._pending
 
-    def submit(self, frame, use_mock: bool = False):
+    def submit(self, frame, use_mock: bool = False) -> bool:
         """
-        Submit a frame for analysis. Non-blocking — returns immediately.
-        The analysis runs in a background thread.
+        Submit a candidate frame for analysis. Non-blocking — returns immediately.
+        Frames are collected for up to BATCH_WINDOW seconds (or until
+        BATCH_FRAMES arrive), then analyzed on ANALYZER_POOL; frames submitted
+        while that analysis runs are ignored. Returns True if this frame
+        started a new batch.
         """
+        if self._pending:
+            return False  # already analyzing, skip without copying the frame
+        # preprocess_frame() gives us a private copy of the caller's buffer
+        processed = preprocess_frame(frame)
         with self._lock:
             if self._pending:
-                return  # already analyzing, skip
-            self._pending = True
+                return False
+            self._batch.append(processed)
+            self._use_mock = use_mock
+            if self._collecting:
+                if len(self._batch) >= BATCH_FRAMES:
+                    self._dispatch_batch()
+                return False
+            self._collecting = True
             self._result = None
+            if len(self._batch) >= BATCH_FRAMES:
+                self._dispatch_batch()
+            else:
+                self._batch_timer = threading.Timer(BATCH_WINDOW, self._on_batch_timeout)
+                self._batch_timer.daemon = True
+                self._batch_timer.start()
+        return True
 
-        # Store frame b64 for event logging later
-        processed = preprocess_frame(frame)
-        self._frame_b64 = frame_to_base64(processed)
-
-        def _run():
-            try:
-                if use_mock:
-                    result = analyze_frame_mock(processed)
-                else:
-                    result = analyze_frame(processed)
-
-                with self._lock:
-                    self._result = result
-                    self._pending = False
-            except Exception as e:
-                print(f"[BG-ANALYZER] Error: {e}")
-                with self._lock:
-                    self._result = {"error": str(e)}
-                    self._pending = False
-
-        thread = threading.Thread(target=_run, daemon=True)
-        thread.start()
+    def _on_batch_timeout(self):
+        with self._lock:
+            if self._collecting:
+                self._dispatch_batch()
+
+    def _dispatch_batch(self):
+        """Send the collected frames to ANALYZER_POOL. Caller holds self._lock."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        frames = list(self._batch)
+        self._batch.clear()
+        self._collecting = False
+        self._pending = True
+        ANALYZER_POOL.submit(self._run, frames, self._use_mock)
+
+    def _run(self, frames, use_mock):
+        # Encode once: the latest frame's JPEG is what gets logged, and is also
+        # sent to Claude (Base64'd only then) when only one frame was collected.
+        latest = frames[-1]
+        frame_jpeg = frame_to_jpeg(latest)
+        try:
+            if use_mock:
+                result = analyze_frame_mock(latest)
+            elif len(frames) == 1:
+                result = analyze_frame(latest, img_b64=base64.b64encode(frame_jpeg).decode("utf-8"))
+            else:
+                grid = tile_frames(frames)
+                result = analyze_frame(grid, img_b64=frame_to_base64(grid), frame_count=len(frames))
+        except Exception as e:
+            print(f"[BG-ANALYZER] Error: {e}")
+            result = {"error": str(e)}
+
+        with self._lock:
+            self._result = result
+            self._frame_jpeg = frame_jpeg
+            self._pending = False
+            self._done.set()
 
     def get_result(self) -> tuple:
         """
         Check if a result is ready. Non-blocking.
-        Returns (result_dict_or_None, frame_b64_or_None).
+        Returns (result_dict_or_None, frame_jpeg_bytes_or_None).
         """
+        if not self._done.is_set():
+            return None, None
         with self._lock:
+            self._done.clear()
             if self._result is not None:
                 result = self._result
-                b64 = self._frame_b64
+                jpeg = self._frame_jpeg
                 self._result = None
-                self._frame_b64 = None
-                return result, b64
+                self._frame_jpeg = None
+                return result, jpeg
         return None, None
+
+
+# ---------------------------------------------------------------------------
+# Capture thread — reads the camera/video off the UI thread (latest frame wins)
+# ---------------------------------------------------------------------------
+
+class CaptureThread(threading.Thread):
+    """
+    Reads frames from a cv2.VideoCapture on a daemon thread and keeps only the
+    latest preprocessed (640x480) frame in a single slot, so a slow UI never
+    works through a backlog and never blocks on the device.
+    Every frame is grab()bed to keep the stream current, but only retrieve()d
+    (decoded, converted and resized) while a consumer is waiting in
+    next_frame() — frames the UI would skip anyway are never decoded.
+    Video files are paced at their own FPS and loop when `loop` is set.
+    """
+
+    def __init__(self, cap, loop: bool = False):
+        super().__init__(daemon=True, name="aegis-capture")
+        self._cap = cap
+        self._loop = loop
+        fps = cap.get(cv2.CAP_PROP_FPS) if loop else 0
+        self._interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self._cond = threading.Condition()
+        self._latest = None
+        self._seq = 0
+        self._taken = 0
+        self._wanted = False  # a consumer is waiting for a new frame
+        self._running = True
+        self._eof = False
+
+    def run(self):
+        while self._running:
+            started = time.monotonic()
+            ret = self._cap.grab()
+            if not ret and self._loop:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret = self._cap.grab()
+            if not ret:
+                break
+            if self._wanted:
+                ret, frame = self._cap.retrieve()
+                if ret:
+                    processed = preprocess_frame(frame)
+                    with self._cond:
+                        self._latest = processed
+                        self._seq += 1
+                        self._wanted = False
+                        self._cond.notify_all()
+            if self._interval:
+                time.sleep(max(0.0, self._interval - (time.monotonic() - started)))
+        # Released here, by the only thread that reads it
+        self._cap.release()
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def next_frame(self, timeout: float = 1.0):
+        """
+        Return the newest frame not yet returned, waiting up to `timeout`
+        seconds for one. Returns None at end of stream or on timeout; check
+        `ended` to tell the two apart. The caller owns the returned array.
+        """
+        with self._cond:
+            if self._seq == self._taken:
+                self._wanted = True
+            if not self._cond.wait_for(lambda: self._seq > self._taken or self._eof, timeout):
+                return None
+            if self._seq == self._taken:
+                return None  # stream ended with nothing new
+            self._taken = self._seq
+            return self._latest
+
+    @property
+    def ended(self) -> bool:
+        """True once the stream is over (end of file, device lost or stopped)."""
+        return self._eof
+
+    def stop(self):
+        """Stop reading; the thread releases the capture device on its way out."""
+        self._running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=2.0)